@@ -1,31 +1,1207 @@
+import argparse
 import asyncio
+import atexit
+import bisect
+import heapq
+import itertools
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import socket
+import sqlite3
+import sys
+import time
+import zlib
+from collections import OrderedDict
+from contextvars import ContextVar
 from datetime import datetime, timedelta
 
-from aiogram import Bot, Dispatcher, F
-from aiogram.filters import Command, CommandStart
-from aiogram.types import Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton
+from aiogram import BaseMiddleware, Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.filters import Command, CommandObject, CommandStart, StateFilter
+from aiogram.types import (
+    Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton,
+    InlineQuery, InlineQueryResultArticle, InlineQueryResultsButton, InputTextMessageContent
+)
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import (
+    GetUpdates, SendMessage, CopyMessage, ForwardMessage, SendPhoto, SendDocument, SendMediaGroup
+)
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-# Logging setup
-logging.basicConfig(level=logging.INFO)
+# Logging setup: records go through a bounded queue to a writer thread, so slow stdout
+# or disk never blocks the event loop
+LOG_LEVEL = logging.INFO
+LOG_FILE = None  # None writes to stdout
+LOG_QUEUE_SIZE = 10000
 
-# Bot token (directly in the code)
-BOT_TOKEN = "enter your token here"  # Replace with your real token
+# Share of INFO records kept for high-volume loggers (warnings and errors are always kept)
+LOG_SAMPLE_RATES = {
+    "aiogram.event": 0.01,
+    "bot.updates": 0.01,
+}
 
-# Creating bot and dispatcher objects
-bot = Bot(token=BOT_TOKEN)
+# Updates slower than this are always logged (in milliseconds)
+SLOW_UPDATE_MS = 1000
+
+# Context of the update being handled, attached to every record: {user_id, handler}
+log_context = ContextVar("log_context", default={})
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line"""
+
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        data.update(getattr(record, "context", {}))
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Keeps every n-th INFO record of high-volume loggers"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.every = {name: max(1, round(1 / rate)) for name, rate in rates.items()}
+        self.counters = dict.fromkeys(rates, 0)
+
+    def filter(self, record):
+        every = self.every.get(record.name)
+        if every is None or record.levelno > logging.INFO:
+            return True
+        self.counters[record.name] += 1
+        return (self.counters[record.name] - 1) % every == 0
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only the cheap part runs on the event loop: the message and the update context
+        # are captured here, JSON is built in the writer thread
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.context = {**log_context.get(), **getattr(record, "context", {})}
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def setup_logging():
+    """Routes all logging through a bounded queue to a background writer thread"""
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+    
+    sink = logging.FileHandler(LOG_FILE, encoding="utf-8") if LOG_FILE else logging.StreamHandler(sys.stdout)
+    sink.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, sink)
+    listener.start()
+    # Write out what is left in the queue on exit
+    atexit.register(listener.stop)
+    
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.handlers = [handler]
+    return handler
+
+log_handler = setup_logging()
+update_logger = logging.getLogger("bot.updates")
+
+# Bot tokens (directly in the code); every bot keeps its own tasks, but they share storage and reminders
+BOT_TOKENS = [
+    "enter your token here",  # Replace with your real token
+]
+
+def token_bot_id(token):
+    """ID of the bot a token belongs to (the part before the colon)"""
+    bot_id = token.split(":")[0]
+    return int(bot_id) if bot_id.isdigit() else 0
+
+# Telegram user IDs allowed to see fleet-wide statistics (/stats fleet)
+ADMIN_IDS = []
+
+# Bot whose update or reminder the current asyncio task is handling
+current_bot_id = ContextVar("current_bot_id", default=0)
+
+class Clock:
+    """Source of the current time for the bot; simulations replace it with a virtual clock"""
+
+    def now(self):
+        return datetime.now()
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+    async def wait(self, event, timeout):
+        """Waits until the event is set or the timeout (in seconds) passes"""
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+class VirtualClock(Clock):
+    """Clock that only moves when advanced, used to simulate days of scheduling in seconds"""
+
+    def __init__(self, start):
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    def advance(self, seconds):
+        self.current += timedelta(seconds=seconds)
+
+    async def sleep(self, seconds):
+        self.advance(seconds)
+
+    async def wait(self, event, timeout):
+        self.advance(timeout)
+
+clock = Clock()
+
+# Outbound Telegram rate budget (messages per second for each bot)
+OUTBOUND_RATE_LIMIT = 30
+
+# Execution lanes in priority order: {name: (max concurrent requests, share of the rate budget)}
+# Interactive updates always win, reminders use the spare capacity
+LANES = {
+    "interactive": (32, 0.7),
+    "background": (8, 0.3),
+}
+
+# Requests that send a message and count against the rate budget; the rest (answering
+# callback and inline queries, edits) only wait for a free slot of their lane
+RATE_LIMITED_METHODS = (SendMessage, CopyMessage, ForwardMessage, SendPhoto, SendDocument, SendMediaGroup)
+
+# Number of workers sending reminders from the queue
+REMINDER_WORKERS = 8
+
+# Lane of the current asyncio task (handlers run in the interactive lane by default)
+current_lane = ContextVar("current_lane", default="interactive")
+
+class Lane:
+    """Execution lane with its own concurrency limit and share of the rate budget"""
+
+    def __init__(self, name, priority, concurrency, rate):
+        self.name = name
+        self.priority = priority
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rate = rate
+        # The bucket holds at most one second worth of the lane's budget
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.waiting = 0
+
+    def refill(self, now):
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+class LaneScheduler:
+    """Shares the outbound rate budget between lanes"""
+
+    def __init__(self, rate_limit, lanes):
+        self.rate_limit = rate_limit
+        self.lanes = {}
+        for priority, (name, (concurrency, share)) in enumerate(lanes.items()):
+            self.lanes[name] = Lane(name, priority, concurrency, rate_limit * share)
+
+    def _take_token(self, lane):
+        now = time.monotonic()
+        for other in self.lanes.values():
+            other.refill(now)
+        
+        # The lane's own share comes first
+        if lane.tokens >= 1:
+            lane.tokens -= 1
+            return True
+        
+        # Borrow spare capacity: a lane may take tokens of a lower-priority lane
+        # at any time, and of a higher-priority lane only while that lane is idle
+        for other in self.lanes.values():
+            if other is lane or other.tokens < 1:
+                continue
+            if other.priority > lane.priority or other.waiting == 0:
+                other.tokens -= 1
+                return True
+        return False
+
+    async def acquire(self, lane):
+        """Waits for a rate token for the given lane"""
+        lane.waiting += 1
+        try:
+            while not self._take_token(lane):
+                await asyncio.sleep(1 / self.rate_limit)
+        finally:
+            lane.waiting -= 1
+
+# Telegram limits every bot separately: {bot_id: LaneScheduler}
+lane_schedulers = {}
+
+def get_lanes(bot_id):
+    if bot_id not in lane_schedulers:
+        lane_schedulers[bot_id] = LaneScheduler(OUTBOUND_RATE_LIMIT, LANES)
+    return lane_schedulers[bot_id]
+
+class LaneMiddleware(BaseRequestMiddleware):
+    """Routes every outgoing API request through the lane of the calling task"""
+
+    async def __call__(self, make_request, bot, method):
+        # Long polling is not an outbound message and must never wait behind reminders
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+        
+        lanes = get_lanes(bot.id)
+        lane = lanes.lanes[current_lane.get()]
+        async with lane.semaphore:
+            if isinstance(method, RATE_LIMITED_METHODS):
+                await lanes.acquire(lane)
+            # Reminders may wait here for a while, the lease could have run out meanwhile
+            if lane.name == "background" and not lease.held(REMINDER_SEND_TIMEOUT):
+                raise LeaseLost()
+            return await make_request(bot, method)
+
+class BotContextMiddleware(BaseMiddleware):
+    """Makes the bot that received an update the current one, so its tasks are used"""
+
+    async def __call__(self, handler, event, data):
+        token = current_bot_id.set(data["bot"].id)
+        try:
+            return await handler(event, data)
+        finally:
+            current_bot_id.reset(token)
+
+class UpdateLogMiddleware(BaseMiddleware):
+    """Sets the logging context of an update and logs its handler and latency"""
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        handler_object = data.get("handler")
+        context = {
+            "bot_id": current_bot_id.get(),
+            "user_id": user.id if user else None,
+            "handler": handler_object.callback.__name__ if handler_object else None,
+        }
+        token = log_context.set(context)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            latency_ms = round((time.perf_counter() - start) * 1000, 1)
+            level = logging.WARNING if latency_ms > SLOW_UPDATE_MS else logging.INFO
+            update_logger.log(level, "Update handled", extra={"context": {**context, "latency_ms": latency_ms}})
+            log_context.reset(token)
+
+# Creating bot and dispatcher objects (bots are created at startup, so simulations need no token)
+# {bot_id: Bot}
+bots = {}
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
+dp.update.outer_middleware(BotContextMiddleware())
+for observer in (dp.message, dp.callback_query, dp.inline_query):
+    observer.middleware(UpdateLogMiddleware())
+
+# SQLite database with user tasks and the archive
+DB_PATH = "tasks.db"
+
+# Memory caps for the cache of per-user task sets
+TASK_CACHE_MAX_USERS = 10000
+TASK_CACHE_MAX_TASKS = 200000
+
+# Number of stored task sets read at a time when all of them are scanned
+TASK_SCAN_CHUNK = 1000
+
+# How often task sets used since the last write are written to the database (in seconds);
+# a leader that crashes loses at most this much of task changes
+TASK_FLUSH_INTERVAL = 1
+
+# How often all resident task sets are written, for changes made to a task set after its write
+# (in seconds)
+TASK_FULL_FLUSH_INTERVAL = 60
+
+# Completed tasks are archived after this grace period (the user can still undo completion)
+ARCHIVE_COMPLETED_AFTER = timedelta(hours=1)
+
+# Unfinished tasks are archived when their deadline passed this long ago
+ARCHIVE_OVERDUE_AFTER = timedelta(days=7)
+
+# How often the archiver runs (in seconds)
+ARCHIVE_INTERVAL = 600
+
+# Number of archived tasks shown per page
+ARCHIVE_PAGE_SIZE = 10
+
+# Queue of rendered reminders waiting to be sent in the background lane:
+# (bot_id, chat_id, text, reply_markup, idempotency key or None)
+reminder_queue = asyncio.Queue()
+
+# Reminders of the batch being fired, queued once their keys are claimed in the sent reminder log
+reminder_outbox = []
+
+# How often confirmed and released reminder claims are written (in seconds)
+SENT_REMINDER_FLUSH_INTERVAL = 1
+
+# Default reminder offsets: seconds before the deadline at which reminders are sent (24h, 1h, 5min, due)
+DEFAULT_REMINDER_OFFSETS = (86400, 3600, 300, 0)
+
+# Offsets the user can choose from the reminder keyboard (3d, 1d, 2h, 1h, 30m, 15m, 5m, due)
+REMINDER_OFFSET_CHOICES = (259200, 86400, 7200, 3600, 1800, 900, 300, 0)
+
+# Reminders of the last few minutes before the deadline are marked as urgent
+URGENT_REMINDER_OFFSET = 300
+
+# Snooze buttons on reminders: {callback value: (button text, delay in seconds or None for tomorrow morning)}
+SNOOZE_CHOICES = {"10m": ("💤 10m", 600), "1h": ("💤 1h", 3600), "tomorrow": ("💤 Tomorrow", None)}
+SNOOZE_TOMORROW_HOUR = 9
+
+# A stage that was missed by no more than this is still sent (e.g. after a restart)
+REMINDER_GRACE = timedelta(minutes=1)
+
+# Longest pause of the reminder loop (in seconds)
+REMINDER_MAX_SLEEP = 30
+
+# Pause before a batch of reminders that failed on a database error is tried again (in seconds)
+REMINDER_RETRY_DELAY = 1
+
+# Number of due fires handled at once before the reminder loop lets handlers run
+REMINDER_BATCH_SIZE = 500
+
+# Replicas sharing the database elect one of them to send reminders through a lease (in seconds)
+LEASE_TTL = 6
+LEASE_RENEW_INTERVAL = 2
+
+# Longest wait for Telegram to take a reminder (in seconds). A reminder goes out only while the lease
+# stays valid at least this long, so it cannot arrive after another replica took over and sent it;
+# it must stay below LEASE_TTL - LEASE_RENEW_INTERVAL
+REMINDER_SEND_TIMEOUT = 3
+
+# Name of this replica in the lease and the sent reminder log
+REPLICA_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# A replica taking over the scheduler still sends stages missed by no more than this
+# (stages the previous leader already sent are skipped through the sent reminder log)
+REMINDER_CATCH_UP = timedelta(minutes=5)
+
+# How long keys of sent reminders are kept
+SENT_REMINDER_RETENTION = timedelta(days=7)
+
+# Counters of open, overdue, completed and on-time tasks, in the order of UserTasks.task_counters
+STAT_COUNTERS = ("open", "overdue", "completed", "on_time")
+
+class UserTasks(dict):
+    """Tasks of one chat: {task_id: {name, deadline, completed, reminded}}
+    
+    Tasks are keyed by chat ID, which is the user's own ID in a private chat.
+    Tasks of a group chat may have assignees: {assignees: [user_id], done: bitmask of assignees who finished}
+    """
+
+    def __init__(self, *args, last_id=0, offsets=None, stats=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Last issued task id, so ids stay unique after tasks are archived or deleted
+        self.last_id = last_id
+        # Default reminder offsets of the chat (None means DEFAULT_REMINDER_OFFSETS)
+        self.offsets = offsets
+        # Statistics counters of the chat: {name: value}, see count_task
+        self.stats = stats if stats is not None else {}
+        # Counters each task contributes to the statistics: {task_id: (open, overdue, completed, on_time)}
+        # (collected on load, before any task can change)
+        self.counted = {task_id: self.task_counters(task) for task_id, task in self.items()}
+        # Unfinished tasks sorted by deadline: [(deadline_ts, task_id)], built on first agenda query
+        self.by_deadline = None
+        # Deadline timestamps of the tasks in by_deadline: {task_id: deadline_ts}
+        self.deadline_ts = {}
+
+    def _build_deadline_index(self):
+        # Sorted once, inserting every task in order would move the list for each of them
+        self.by_deadline = []
+        for task_id, task in self.items():
+            deadline_ts = self._record_deadline(task_id, task)
+            if deadline_ts is not None:
+                self.by_deadline.append((deadline_ts, task_id))
+        self.by_deadline.sort()
+
+    def _record_deadline(self, task_id, task):
+        """Remembers the deadline timestamp of an unfinished task, returns None for other tasks"""
+        if task["completed"]:
+            return None
+        try:
+            deadline_ts = parse_deadline(task["deadline"]).timestamp()
+        except ValueError:
+            return None
+        self.deadline_ts[task_id] = deadline_ts
+        return deadline_ts
+
+    def index_deadline(self, task_id):
+        """Updates the position of a created, edited, completed or removed task in the deadline index"""
+        if self.by_deadline is None:
+            return
+        old_ts = self.deadline_ts.pop(task_id, None)
+        if old_ts is not None:
+            del self.by_deadline[bisect.bisect_left(self.by_deadline, (old_ts, task_id))]
+        if task_id in self:
+            deadline_ts = self._record_deadline(task_id, self[task_id])
+            if deadline_ts is not None:
+                bisect.insort(self.by_deadline, (deadline_ts, task_id))
+
+    def due_between(self, start_ts, end_ts):
+        """IDs of unfinished tasks with start_ts <= deadline < end_ts, earliest first"""
+        if self.by_deadline is None:
+            self._build_deadline_index()
+        lo = bisect.bisect_left(self.by_deadline, (start_ts,))
+        hi = bisect.bisect_left(self.by_deadline, (end_ts,))
+        return [task_id for _, task_id in self.by_deadline[lo:hi]]
+
+    @staticmethod
+    def task_counters(task):
+        """Counters a task contributes to: (open, overdue, completed, on_time)"""
+        if task["completed"]:
+            return (0, 0, 1, 1 if task.get("on_time") else 0)
+        return (1, 1 if task.get("overdue") else 0, 0, 0)
+
+    def count_task(self, task_id, now, created=False):
+        """Updates the statistics after a task was created, edited, completed, removed or became overdue.
+        
+        Only the difference between the task's old and new contribution is applied, so this is O(1).
+        Returns the changed counters: {name: delta}
+        """
+        deltas = {}
+        if created:
+            if not self.stats.get("created"):
+                deltas["users"] = 1
+            deltas["created"] = 1
+        
+        old = self.counted.pop(task_id, (0, 0, 0, 0))
+        task = self.get(task_id)
+        if task is None:
+            # A removed task stays in the completion history
+            new = (0, 0, old[2], old[3])
+        else:
+            if task["completed"] and not old[2]:
+                self._count_completion(task, now)
+            elif not task["completed"]:
+                task.pop("on_time", None)
+            if task.get("overdue"):
+                try:
+                    if parse_deadline(task["deadline"]) > now:
+                        # The deadline was moved to the future
+                        del task["overdue"]
+                except ValueError:
+                    pass
+            new = self.task_counters(task)
+            self.counted[task_id] = new
+        
+        for name, before, after in zip(STAT_COUNTERS, old, new):
+            if after != before:
+                deltas[name] = after - before
+        for name, delta in deltas.items():
+            if name != "users":
+                self.stats[name] = self.stats.get(name, 0) + delta
+        return deltas
+
+    def _count_completion(self, task, now):
+        completed_at = now
+        if "completed_at" in task:
+            completed_at = datetime.strptime(task["completed_at"], "%d.%m.%Y %H:%M")
+        try:
+            task["on_time"] = completed_at <= parse_deadline(task["deadline"])
+        except ValueError:
+            task["on_time"] = True
+        
+        # Streak of consecutive days with at least one completed task
+        day = completed_at.toordinal()
+        last_day = self.stats.get("streak_day", 0)
+        if day == last_day + 1:
+            self.stats["streak"] += 1
+        elif day > last_day:
+            self.stats["streak"] = 1
+        if day > last_day:
+            self.stats["streak_day"] = day
+            self.stats["best_streak"] = max(self.stats.get("best_streak", 0), self.stats["streak"])
+
+class TaskStore:
+    """Per-chat task sets paged in from SQLite on first use and kept in a size-bounded LRU.
+    
+    Task sets are namespaced by the bot in current_bot_id, so several bots share one store.
+    They are written back when they are evicted or flushed, and only if they changed.
+    Each row has a version, so a write over a task set that another replica changed
+    since it was loaded is refused and the stale copy is dropped instead.
+    """
+
+    def __init__(self, path, max_users, max_tasks, legacy_bot_id=0):
+        self.db = sqlite3.connect(path)
+        self._migrate(legacy_bot_id)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS user_tasks ("
+            "bot_id INTEGER NOT NULL, user_id INTEGER NOT NULL, data TEXT NOT NULL, "
+            "version INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (bot_id, user_id))"
+        )
+        if "version" not in [row[1] for row in self.db.execute("PRAGMA table_info(user_tasks)")]:
+            self.db.execute("ALTER TABLE user_tasks ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS archived_tasks ("
+            "bot_id INTEGER NOT NULL, user_id INTEGER NOT NULL, task_id TEXT NOT NULL, data BLOB NOT NULL, "
+            "PRIMARY KEY (bot_id, user_id, task_id))"
+        )
+        self.db.commit()
+        self.max_users = max_users
+        self.max_tasks = max_tasks
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+        self.conflicts = 0
+        self.reset()
+
+    def reset(self):
+        """Forgets resident task sets and reloads the statistics, for when another replica may have changed them"""
+        # {(bot_id, user_id): UserTasks} in LRU order
+        self.cache = OrderedDict()
+        # Serialized form of each resident task set as it was last loaded or written
+        self.saved = {}
+        # Stored version of each resident task set, None until it is first written
+        self.versions = {}
+        # Task sets used since the last write, the only ones that may have changed
+        self.touched = set()
+        # Number of tasks of each resident user when it was last touched
+        self.sizes = {}
+        self.resident_tasks = 0
+        # Changes of the statistics not written yet, added to the stored totals on flush
+        self.fleet_deltas = {}
+        # Without the statistics table, stored task sets are counted once at startup (see seed_stats)
+        self.needs_seeding = not self._table_exists("fleet_stats")
+        self._load_fleet()
+
+    def _load_fleet(self):
+        # Statistics of all chats of each bot: {bot_id: {name: value}}, including changes not written yet
+        self.fleet = {}
+        if not self.needs_seeding:
+            for bot_id, name, value in self.db.execute("SELECT bot_id, name, value FROM fleet_stats"):
+                self.fleet.setdefault(bot_id, {})[name] = value
+        for bot_id, deltas in self.fleet_deltas.items():
+            stats = self.fleet.setdefault(bot_id, {})
+            for name, delta in deltas.items():
+                stats[name] = stats.get(name, 0) + delta
+
+    def _migrate(self, legacy_bot_id):
+        """Moves tables of a single-bot database under the legacy bot's ID"""
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(user_tasks)")]
+        if not columns or "bot_id" in columns:
+            return
+        with self.db:
+            for table, key_columns in (("user_tasks", "user_id"), ("archived_tasks", "user_id, task_id")):
+                self.db.execute(f"ALTER TABLE {table} RENAME TO legacy_{table}")
+            self.db.execute(
+                "CREATE TABLE user_tasks ("
+                "bot_id INTEGER NOT NULL, user_id INTEGER NOT NULL, data TEXT NOT NULL, "
+                "PRIMARY KEY (bot_id, user_id))"
+            )
+            self.db.execute(
+                "CREATE TABLE archived_tasks ("
+                "bot_id INTEGER NOT NULL, user_id INTEGER NOT NULL, task_id TEXT NOT NULL, data BLOB NOT NULL, "
+                "PRIMARY KEY (bot_id, user_id, task_id))"
+            )
+            self.db.execute(
+                "INSERT INTO user_tasks SELECT ?, user_id, data FROM legacy_user_tasks", (legacy_bot_id,)
+            )
+            self.db.execute(
+                "INSERT INTO archived_tasks SELECT ?, user_id, task_id, data FROM legacy_archived_tasks ORDER BY rowid",
+                (legacy_bot_id,)
+            )
+            self.db.execute("DROP TABLE legacy_user_tasks")
+            self.db.execute("DROP TABLE legacy_archived_tasks")
+
+    @staticmethod
+    def serialize(user_tasks):
+        data = {"last_id": user_tasks.last_id, "tasks": user_tasks}
+        if user_tasks.offsets is not None:
+            data["offsets"] = user_tasks.offsets
+        if user_tasks.stats:
+            data["stats"] = user_tasks.stats
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+    @staticmethod
+    def deserialize(data):
+        data = json.loads(data)
+        return UserTasks(data["tasks"], last_id=data["last_id"], offsets=data.get("offsets"), stats=data.get("stats"))
+
+    def _touch(self, key):
+        self.cache.move_to_end(key)
+        size = len(self.cache[key])
+        self.resident_tasks += size - self.sizes.get(key, 0)
+        self.sizes[key] = size
+
+    def _load(self, key):
+        """Pages in a task set, returns False if there is none"""
+        if key in self.cache:
+            self.hits += 1
+            self._touch(key)
+            return True
+        
+        self.misses += 1
+        row = self.db.execute("SELECT data, version FROM user_tasks WHERE bot_id = ? AND user_id = ?", key).fetchone()
+        if row is None:
+            return False
+        self.cache[key] = self.deserialize(row[0])
+        self.saved[key], self.versions[key] = row
+        self._touch(key)
+        self._evict()
+        return True
+
+    def _write(self, key):
+        """Writes a changed task set, returns False if another replica changed it first"""
+        data = self.serialize(self.cache[key])
+        if data == self.saved.get(key):
+            return True
+        version = self.versions.get(key)
+        if version is None:
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO user_tasks (bot_id, user_id, data, version) VALUES (?, ?, ?, 1)", (*key, data)
+            )
+        else:
+            cursor = self.db.execute(
+                "UPDATE user_tasks SET data = ?, version = version + 1 WHERE bot_id = ? AND user_id = ? AND version = ?",
+                (data, *key, version)
+            )
+        if cursor.rowcount == 0:
+            logging.warning("Task set %s was changed by another replica, local changes are dropped", key)
+            self.conflicts += 1
+            return False
+        self.saved[key] = data
+        self.versions[key] = (version or 0) + 1
+        self.writes += 1
+        return True
+
+    def _drop(self, key):
+        del self.cache[key]
+        del self.saved[key]
+        self.versions.pop(key, None)
+        self.touched.discard(key)
+        self.resident_tasks -= self.sizes.pop(key)
+
+    def _evict(self):
+        # The most recently used task set always stays resident
+        while len(self.cache) > 1 and (len(self.cache) > self.max_users or self.resident_tasks > self.max_tasks):
+            key = next(iter(self.cache))
+            self._write(key)
+            self._drop(key)
+            self.evictions += 1
+        self.db.commit()
+
+    def page_in(self, keys):
+        """Loads the task sets of many (bot_id, user_id) keys with one query per chunk"""
+        missing = [key for key in keys if key not in self.cache]
+        self.misses += len(missing)
+        for start in range(0, len(missing), 400):
+            chunk = missing[start:start + 400]
+            rows = self.db.execute(
+                "SELECT bot_id, user_id, data, version FROM user_tasks WHERE (bot_id, user_id) IN (VALUES "
+                + ", ".join(["(?, ?)"] * len(chunk)) + ")",
+                [value for key in chunk for value in key]
+            )
+            for bot_id, user_id, data, version in rows:
+                key = (bot_id, user_id)
+                self.cache[key] = self.deserialize(data)
+                self.saved[key] = data
+                self.versions[key] = version
+                self._touch(key)
+        self._evict()
+
+    def __contains__(self, user_id):
+        return self._load((current_bot_id.get(), user_id))
+
+    def __getitem__(self, user_id):
+        key = (current_bot_id.get(), user_id)
+        if not self._load(key):
+            raise KeyError(user_id)
+        self.touched.add(key)
+        return self.cache[key]
+
+    def __setitem__(self, user_id, user_tasks):
+        if not isinstance(user_tasks, UserTasks):
+            user_tasks = UserTasks(user_tasks)
+        key = (current_bot_id.get(), user_id)
+        self.cache[key] = user_tasks
+        self.saved.setdefault(key, None)
+        self.touched.add(key)
+        self._touch(key)
+        self._evict()
+
+    def resident(self):
+        """Task sets that are currently in memory (without changing the LRU order): [((bot_id, user_id), UserTasks)]"""
+        return list(self.cache.items())
+
+    def flush(self, touched_only=False):
+        """Writes all changed resident task sets (or only those used since the last write) and the fleet statistics"""
+        keys = [key for key in self.touched if key in self.cache] if touched_only else list(self.cache)
+        stale = [key for key in keys if not self._write(key)]
+        # Cleared only after all writes, so the task sets of a failed flush are written by the next one
+        self.touched = set()
+        for key in stale:
+            self._drop(key)
+        # Until seed_stats runs the table does not exist and the totals are counted from scratch
+        if self.fleet_deltas and not self.needs_seeding:
+            self.db.executemany(
+                "INSERT INTO fleet_stats (bot_id, name, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (bot_id, name) DO UPDATE SET value = value + excluded.value",
+                [(bot_id, name, delta) for bot_id, deltas in self.fleet_deltas.items() for name, delta in deltas.items()]
+            )
+            self.fleet_deltas = {}
+        self.db.commit()
+
+    def count(self, deltas, bot_id=None):
+        """Adds changes of the statistics of a chat to the totals of its bot"""
+        if not deltas:
+            return
+        if bot_id is None:
+            bot_id = current_bot_id.get()
+        stats = self.fleet.setdefault(bot_id, {})
+        pending = self.fleet_deltas.setdefault(bot_id, {})
+        for name, delta in deltas.items():
+            stats[name] = stats.get(name, 0) + delta
+            pending[name] = pending.get(name, 0) + delta
+
+    def seed_stats(self, now):
+        """Counts the statistics of task sets stored before statistics were kept (one full scan)"""
+        for _ in self.seed_stats_steps(now):
+            pass
+
+    def seed_stats_steps(self, now, chunk_size=TASK_SCAN_CHUNK):
+        """Counts the statistics like seed_stats, one chunk of task sets per step.
+        
+        The counts of a chunk are committed together with its position, so an interrupted
+        count goes on after the last finished chunk. The totals become fleet_stats at the end.
+        """
+        if not self.needs_seeding:
+            return
+        if not self._table_exists("fleet_stats_progress"):
+            self.db.execute("DROP TABLE IF EXISTS fleet_stats_seed")
+            self.db.execute(
+                "CREATE TABLE fleet_stats_seed ("
+                "bot_id INTEGER NOT NULL, name TEXT NOT NULL, value INTEGER NOT NULL, "
+                "PRIMARY KEY (bot_id, name))"
+            )
+            self.db.execute("CREATE TABLE fleet_stats_progress (bot_id INTEGER NOT NULL, user_id INTEGER NOT NULL)")
+        after = self.db.execute("SELECT bot_id, user_id FROM fleet_stats_progress").fetchone()
+        counted = 0
+        while True:
+            rows = self._read_chunk(after, chunk_size)
+            if not rows:
+                break
+            totals = {}
+            for bot_id, user_id, data in rows:
+                user_tasks = self.deserialize(data)
+                user_tasks.counted = {}
+                for task_id in list(user_tasks):
+                    for name, delta in user_tasks.count_task(task_id, now, created=True).items():
+                        totals[bot_id, name] = totals.get((bot_id, name), 0) + delta
+                self.db.execute(
+                    "UPDATE user_tasks SET data = ?, version = version + 1 WHERE bot_id = ? AND user_id = ?",
+                    (self.serialize(user_tasks), bot_id, user_id)
+                )
+            self.db.executemany(
+                "INSERT INTO fleet_stats_seed (bot_id, name, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (bot_id, name) DO UPDATE SET value = value + excluded.value",
+                [(bot_id, name, value) for (bot_id, name), value in totals.items()]
+            )
+            after = rows[-1][:2]
+            self.db.execute("DELETE FROM fleet_stats_progress")
+            self.db.execute("INSERT INTO fleet_stats_progress (bot_id, user_id) VALUES (?, ?)", after)
+            self.db.commit()
+            counted += len(rows)
+            yield
+        self.db.execute("ALTER TABLE fleet_stats_seed RENAME TO fleet_stats")
+        self.db.execute("DROP TABLE fleet_stats_progress")
+        self.db.commit()
+        self.needs_seeding = False
+        self._load_fleet()
+        logging.info("Statistics counted for %d stored task sets", counted)
 
-# Dictionary for storing user tasks: {user_id: {task_id: {name, deadline, completed, reminded}}}
-tasks = {}
+    def _table_exists(self, name):
+        return self.db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
 
-# Dictionary for tracking reminders
-reminders = {}
+    def _read_chunk(self, after, size):
+        """Stored task sets with keys following after (from the first one if None): [(bot_id, user_id, data)]"""
+        if after is None:
+            return self.db.execute(
+                "SELECT bot_id, user_id, data FROM user_tasks ORDER BY bot_id, user_id LIMIT ?", (size,)
+            ).fetchall()
+        return self.db.execute(
+            "SELECT bot_id, user_id, data FROM user_tasks WHERE (bot_id, user_id) > (?, ?) "
+            "ORDER BY bot_id, user_id LIMIT ?",
+            (*after, size)
+        ).fetchall()
+
+    def iter_chunks(self, chunk_size=TASK_SCAN_CHUNK):
+        """Iterates over all task sets of all bots in chunks without making them resident.
+        
+        Yields lists of ((bot_id, user_id), UserTasks); resident task sets are used instead of
+        their stored copies. No query stays open between chunks, so the database can be written meanwhile.
+        """
+        after = None
+        while True:
+            rows = self._read_chunk(after, chunk_size)
+            if not rows:
+                break
+            after = rows[-1][:2]
+            chunk = []
+            for bot_id, user_id, data in rows:
+                key = (bot_id, user_id)
+                chunk.append((key, self.cache[key] if key in self.cache else self.deserialize(data)))
+            yield chunk
+        # Task sets created since the last write
+        unsaved = [(key, user_tasks) for key, user_tasks in self.cache.items() if self.saved.get(key) is None]
+        if unsaved:
+            yield unsaved
+
+    def metrics(self):
+        lookups = self.hits + self.misses
+        return {
+            "resident_users": len(self.cache),
+            "resident_tasks": self.resident_tasks,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "writes": self.writes,
+            "conflicts": self.conflicts,
+        }
+
+    # Cold storage for completed and long-overdue tasks (compressed JSON per task)
+    def archive_put(self, user_id, task_id, data):
+        self.db.execute(
+            "INSERT OR REPLACE INTO archived_tasks (bot_id, user_id, task_id, data) VALUES (?, ?, ?, ?)",
+            (current_bot_id.get(), user_id, task_id, data)
+        )
+        self.db.commit()
+
+    def archive_get(self, user_id, task_id):
+        row = self.db.execute(
+            "SELECT data FROM archived_tasks WHERE bot_id = ? AND user_id = ? AND task_id = ?",
+            (current_bot_id.get(), user_id, task_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def archive_delete(self, user_id, task_id):
+        self.db.execute(
+            "DELETE FROM archived_tasks WHERE bot_id = ? AND user_id = ? AND task_id = ?",
+            (current_bot_id.get(), user_id, task_id)
+        )
+        self.db.commit()
+
+    def archive_count(self, user_id):
+        return self.db.execute(
+            "SELECT COUNT(*) FROM archived_tasks WHERE bot_id = ? AND user_id = ?", (current_bot_id.get(), user_id)
+        ).fetchone()[0]
+
+    def archive_page(self, user_id, offset, limit):
+        """Archived tasks of the user, newest first: [(task_id, data)]"""
+        return self.db.execute(
+            "SELECT task_id, data FROM archived_tasks WHERE bot_id = ? AND user_id = ? "
+            "ORDER BY rowid DESC LIMIT ? OFFSET ?",
+            (current_bot_id.get(), user_id, limit, offset)
+        ).fetchall()
+
+class ReminderIndex:
+    """Compact index of upcoming reminder fires.
+    
+    Holds one entry per task (its next stage) in a heap; rescheduling or
+    cancelling a task leaves its old heap entry stale, and stale entries are
+    skipped when popped. A fired stage is replaced by the task's next one,
+    so any number of stages costs O(log n) each.
+    
+    Snoozes are one-off entries keyed by (bot_id, user_id, task_id, recipient) with no offsets;
+    snoozing again replaces the pending entry, so there is at most one per recipient.
+    """
+
+    def __init__(self):
+        self.heap = []
+        # {key: (fire_ts, seq, deadline_ts, offsets, stage)}, offsets tuples are shared between tasks
+        # and are None for snoozes
+        self.pending = {}
+        self.seq = itertools.count()
+        # Set when a fire earlier than the current earliest one is scheduled
+        self.wakeup = asyncio.Event()
+
+    def schedule(self, key, fire_ts, deadline_ts, offsets, stage):
+        seq = next(self.seq)
+        if not self.heap or fire_ts < self.heap[0][0]:
+            self.wakeup.set()
+        self.pending[key] = (fire_ts, seq, deadline_ts, offsets, stage)
+        heapq.heappush(self.heap, (fire_ts, seq, key))
+        # Drop stale entries once they outnumber the live ones
+        if len(self.heap) > 2 * len(self.pending) + 1024:
+            self.heap = [(entry[0], entry[1], key) for key, entry in self.pending.items()]
+            heapq.heapify(self.heap)
+
+    def cancel(self, key):
+        self.pending.pop(key, None)
+
+    def clear(self):
+        self.heap = []
+        self.pending = {}
+
+    def _drop_stale(self):
+        while self.heap:
+            _, seq, key = self.heap[0]
+            entry = self.pending.get(key)
+            if entry is not None and entry[1] == seq:
+                return
+            heapq.heappop(self.heap)
+
+    def next_fire(self):
+        """Timestamp of the earliest pending fire or None"""
+        self._drop_stale()
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now_ts, limit=None):
+        """Removes and returns due fires, at most limit of them: [(key, deadline_ts, offsets, stage)]"""
+        due = []
+        while limit is None or len(due) < limit:
+            self._drop_stale()
+            if not self.heap or self.heap[0][0] > now_ts:
+                return due
+            _, _, key = heapq.heappop(self.heap)
+            _, _, deadline_ts, offsets, stage = self.pending.pop(key)
+            due.append((key, deadline_ts, offsets, stage))
+        return due
+
+# Inline mode: how long Telegram and our cache keep the results of a query (in seconds)
+INLINE_CACHE_TIME = 10
+INLINE_CACHE_MAX_USERS = 10000
+# Telegram shows at most 50 inline results
+INLINE_MAX_RESULTS = 50
+
+class InlineResultCache:
+    """Per-user cache of inline query matches with a short TTL.
+    
+    A query that extends a cached one ("pay r" after "pay") only filters the cached matches,
+    so typing does not re-scan all tasks on every keystroke.
+    """
+
+    def __init__(self, ttl, max_users):
+        self.ttl = ttl
+        self.max_users = max_users
+        # {(bot_id, user_id): (expires_at, {query: [task_id]})} in LRU order
+        self.entries = OrderedDict()
+
+    def _queries(self, user_id):
+        key = (current_bot_id.get(), user_id)
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            entry = (time.monotonic() + self.ttl, {})
+            self.entries[key] = entry
+            while len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def search(self, user_id, query, user_tasks):
+        """Returns IDs of tasks whose names contain the query"""
+        queries = self._queries(user_id)
+        if query in queries:
+            return queries[query]
+        
+        if not query:
+            # Unfinished tasks first, earliest deadline first
+            matches = user_tasks.due_between(float("-inf"), float("inf"))
+            matches += [task_id for task_id, task in user_tasks.items() if task_id not in user_tasks.deadline_ts]
+        else:
+            # Narrow down the matches of the longest cached prefix
+            candidates = None
+            for length in range(len(query) - 1, 0, -1):
+                if query[:length] in queries:
+                    candidates = queries[query[:length]]
+                    break
+            if candidates is None:
+                candidates = user_tasks.keys()
+            matches = [
+                task_id for task_id in candidates
+                if task_id in user_tasks and query in user_tasks[task_id]["name"].lower()
+            ]
+        
+        queries[query] = matches
+        return matches
+
+    def invalidate(self, user_id):
+        self.entries.pop((current_bot_id.get(), user_id), None)
+
+# Per-chat task sets of the current bot: {chat_id: UserTasks}
+# Tasks of a database created before multi-bot support belong to the first bot
+tasks = TaskStore(DB_PATH, TASK_CACHE_MAX_USERS, TASK_CACHE_MAX_TASKS, token_bot_id(BOT_TOKENS[0]))
+
+# Upcoming reminder fires keyed by (bot_id, user_id, task_id)
+reminder_index = ReminderIndex()
+
+# Cached inline query matches
+inline_cache = InlineResultCache(INLINE_CACHE_TIME, INLINE_CACHE_MAX_USERS)
+
+class SchedulerLease:
+    """Lease in the shared database that elects the replica running the reminder scheduler.
+    
+    The holder renews it every LEASE_RENEW_INTERVAL seconds; when the holder stops,
+    another replica takes over once the lease has not been renewed for its TTL.
+    """
+
+    def __init__(self, path, holder, ttl):
+        self.db = sqlite3.connect(path, timeout=1, isolation_level=None)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS scheduler_lease ("
+            "name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self.holder = holder
+        self.ttl = ttl
+        # The lease is ours until this time.monotonic() moment
+        self.valid_until = 0.0
+
+    def renew(self):
+        """Acquires or renews the lease, returns whether this replica holds it"""
+        start = time.monotonic()
+        now = time.time()
+        try:
+            self.db.execute("BEGIN IMMEDIATE")
+            row = self.db.execute("SELECT holder, expires_at FROM scheduler_lease WHERE name = 'scheduler'").fetchone()
+            held = row is None or row[0] == self.holder or row[1] < now
+            if held:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO scheduler_lease (name, holder, expires_at) VALUES ('scheduler', ?, ?)",
+                    (self.holder, now + self.ttl)
+                )
+            self.db.execute("COMMIT")
+        except sqlite3.OperationalError:
+            # The database stayed locked; the lease runs out unless a later renewal succeeds
+            logging.exception("Failed to renew the scheduler lease")
+            if self.db.in_transaction:
+                self.db.execute("ROLLBACK")
+            return self.held()
+        self.valid_until = start + self.ttl if held else 0.0
+        return held
+
+    def held(self, margin=0):
+        """Whether the lease stays ours for at least margin more seconds"""
+        return time.monotonic() + margin < self.valid_until
+
+    def release(self):
+        """Gives the lease up, so another replica takes over at once"""
+        self.valid_until = 0.0
+        try:
+            self.db.execute("DELETE FROM scheduler_lease WHERE name = 'scheduler' AND holder = ?", (self.holder,))
+        except sqlite3.OperationalError:
+            # Without renewals the lease runs out on its own
+            logging.exception("Failed to release the scheduler lease")
+
+class LeaseLost(Exception):
+    """Raised for a reminder that would go out after the lease could have passed to another replica"""
+
+class SentReminderLog:
+    """Idempotency keys of queued and sent reminders in the shared database.
+    
+    Keys are claimed before reminders are queued and confirmed after delivery, so a stage fired
+    again (after a reschedule or a failover) is not sent twice. A claim whose reminder was dropped
+    or failed is released, so the stage can be fired again. Claims of a batch share one transaction;
+    confirmations and releases are written together by flush().
+    """
+
+    def __init__(self, path, holder):
+        self.db = sqlite3.connect(path, timeout=1, isolation_level=None)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sent_reminders ("
+            "key TEXT PRIMARY KEY, holder TEXT NOT NULL, sent INTEGER NOT NULL, claimed_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS sent_reminders_claimed_at ON sent_reminders (claimed_at)")
+        self.holder = holder
+        self.last_claimed_at = 0.0
+        # Keys waiting for flush()
+        self.sent = []
+        self.released = []
+
+    def claim(self, keys):
+        """Returns the keys of reminders that should be sent now.
+        
+        A key is not returned if its reminder was sent or is queued here already; one that another
+        replica claimed but never confirmed (it failed before sending) is taken over.
+        """
+        if not keys:
+            return set()
+        # Every batch gets its own claim time, which tells the keys claimed by it
+        claimed_at = max(time.time(), self.last_claimed_at + 0.001)
+        self.last_claimed_at = claimed_at
+        self.db.execute("BEGIN")
+        try:
+            self.db.executemany(
+                "INSERT INTO sent_reminders (key, holder, sent, claimed_at) VALUES (?, ?, 0, ?) "
+                "ON CONFLICT (key) DO UPDATE SET holder = excluded.holder, claimed_at = excluded.claimed_at "
+                "WHERE sent = 0 AND holder != excluded.holder",
+                [(key, self.holder, claimed_at) for key in keys]
+            )
+            claimed = {
+                key for key, in self.db.execute(
+                    "SELECT key FROM sent_reminders WHERE claimed_at = ? AND holder = ?", (claimed_at, self.holder)
+                )
+            }
+            self.db.execute("COMMIT")
+        except sqlite3.Error:
+            self.db.execute("ROLLBACK")
+            raise
+        return claimed
+
+    def mark_sent(self, key):
+        self.sent.append(key)
+
+    def release(self, key):
+        """Gives up the claim of a reminder that was not sent"""
+        self.released.append(key)
+
+    def flush(self):
+        """Writes confirmed and released claims in one transaction"""
+        if not self.sent and not self.released:
+            return
+        sent, self.sent = self.sent, []
+        released, self.released = self.released, []
+        self.db.execute("BEGIN")
+        try:
+            self.db.executemany("UPDATE sent_reminders SET sent = 1 WHERE key = ?", [(key,) for key in sent])
+            self.db.executemany(
+                "DELETE FROM sent_reminders WHERE key = ? AND holder = ? AND sent = 0",
+                [(key, self.holder) for key in released]
+            )
+            self.db.execute("COMMIT")
+        except sqlite3.Error:
+            self.db.execute("ROLLBACK")
+            self.sent = sent + self.sent
+            self.released = released + self.released
+            raise
+
+    def prune(self, before):
+        """Forgets reminders claimed before the given timestamp"""
+        self.db.execute("DELETE FROM sent_reminders WHERE claimed_at < ?", (before,))
+
+# Scheduler leadership of this replica
+lease = SchedulerLease(DB_PATH, REPLICA_ID, LEASE_TTL)
+
+# Keys of reminders already queued or sent by any replica
+sent_reminders = SentReminderLog(DB_PATH, REPLICA_ID)
 
 # States for the state machine
 class TaskStates(StatesGroup):
@@ -36,18 +1212,300 @@ class TaskStates(StatesGroup):
     waiting_for_edit_deadline = State()
 
 # Helper functions
-def get_task_keyboard(user_id, task_id=None):
+def parse_deadline(deadline_text):
+    """Converts a deadline string to datetime (date-only deadlines end at 23:59)"""
+    if len(deadline_text.split()) == 1:
+        # Only date (add 23:59)
+        return datetime.strptime(f"{deadline_text} 23:59", "%d.%m.%Y %H:%M")
+    return datetime.strptime(deadline_text, "%d.%m.%Y %H:%M")
+
+def next_task_id(user_id):
+    """Generates a unique ID for a new task of the user"""
+    tasks[user_id].last_id += 1
+    return str(tasks[user_id].last_id)
+
+def create_task(user_id, name, deadline_str):
+    """Adds a new task for the user and returns its ID"""
+    if user_id not in tasks:
+        tasks[user_id] = UserTasks()
+    
+    task_id = next_task_id(user_id)
+    tasks[user_id][task_id] = {
+        "name": name,
+        "deadline": deadline_str,
+        "completed": False,
+        "reminded": False,
+        "created_at": clock.now().strftime("%d.%m.%Y %H:%M")
+    }
+    task_changed(user_id, task_id, created=True)
+    return task_id
+
+# Patterns for the one-message quick-add ("Pay rent 01.11 18:00", "call bob tomorrow 9am")
+QUICK_DATE = re.compile(r"(?<![\d.,])(?:\b(on)\s+)?(\d{1,2})\.(\d{1,2})(?:\.(\d{4}|\d{2}))?(?![.,]?\d)", re.IGNORECASE)
+QUICK_TIME = re.compile(r"\b(?:at\s+)?(\d{1,2})(?::(\d{2}))?\s*(am|pm)\b|\b(?:at\s+)?(\d{1,2}):(\d{2})\b", re.IGNORECASE)
+QUICK_DAY = re.compile(
+    r"\b(?:on\s+)?(today|tonight|tomorrow|monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b",
+    re.IGNORECASE
+)
+QUICK_RELATIVE = re.compile(r"\bin\s+(\d+)\s*(m|min|mins|minutes?|h|hours?|d|days?)\b", re.IGNORECASE)
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+def parse_quick_add(text, now=None):
+    """Splits a message like "Pay rent 01.11 18:00" into a task name and a deadline string.
+    
+    Returns (name, deadline_str) or None if the text has no deadline or it has already passed.
+    """
+    now = now or clock.now()
+    date = time_of_day = None
+    relative_date = relative_time = None
+    
+    # Relative deadline ("in 2h"); an explicit date, day or time in the text takes precedence
+    match = QUICK_RELATIVE.search(text)
+    if match:
+        amount, unit = int(match.group(1)), match.group(2).lower()
+        try:
+            if unit.startswith("m"):
+                delta = timedelta(minutes=amount)
+            elif unit.startswith("h"):
+                delta = timedelta(hours=amount)
+            else:
+                delta = timedelta(days=amount)
+            deadline = now + delta
+        except OverflowError:
+            # Beyond the last representable date
+            return None
+        relative_date, relative_time = deadline.date(), (deadline.hour, deadline.minute)
+        text = text[:match.start()] + text[match.end():]
+    
+    for match in QUICK_DATE.finditer(text):
+        on, day, month, year = match.groups()
+        # A number like "3.2" is only a date after "on", with a year or with a two-digit month
+        if not (on or year or len(month) == 2):
+            continue
+        day, month = int(day), int(month)
+        try:
+            if year:
+                date = datetime(int(year) + (2000 if len(year) == 2 else 0), month, day).date()
+            else:
+                # Without a year take the nearest such date that has not passed
+                date = datetime(now.year, month, day).date()
+                if date < now.date():
+                    date = datetime(now.year + 1, month, day).date()
+        except ValueError:
+            continue
+        text = text[:match.start()] + text[match.end():]
+        break
+    
+    if date is None:
+        match = QUICK_DAY.search(text)
+        if match:
+            word = match.group(1).lower()
+            if word in ("today", "tonight"):
+                date = now.date()
+            elif word == "tomorrow":
+                date = now.date() + timedelta(days=1)
+            else:
+                # Next occurrence of the weekday, a week ahead if it is today
+                days_ahead = (WEEKDAYS.index(word) - now.weekday()) % 7 or 7
+                date = now.date() + timedelta(days=days_ahead)
+            if word == "tonight":
+                time_of_day = (21, 0)
+            text = text[:match.start()] + text[match.end():]
+    
+    match = QUICK_TIME.search(text)
+    if match:
+        if match.group(3):
+            # 12-hour clock
+            hour, minute = int(match.group(1)), int(match.group(2) or 0)
+            if not 1 <= hour <= 12:
+                return None
+            hour = hour % 12 + (12 if match.group(3).lower() == "pm" else 0)
+        else:
+            hour, minute = int(match.group(4)), int(match.group(5))
+        if hour > 23 or minute > 59:
+            return None
+        time_of_day = (hour, minute)
+        text = text[:match.start()] + text[match.end():]
+    
+    if date is None:
+        date = relative_date
+    if time_of_day is None:
+        time_of_day = relative_time
+    if date is None and time_of_day is None:
+        return None
+    
+    # A time without a date means the next such moment
+    if date is None:
+        date = now.date()
+        if time_of_day <= (now.hour, now.minute):
+            date += timedelta(days=1)
+    
+    name = " ".join(text.split()).strip(" ,-—")
+    if not name:
+        return None
+    
+    if time_of_day is None:
+        # All-day task
+        if date < now.date():
+            return None
+        return name, date.strftime("%d.%m.%Y")
+    
+    deadline = datetime(date.year, date.month, date.day, *time_of_day)
+    if deadline < now.replace(second=0, microsecond=0):
+        return None
+    return name, deadline.strftime("%d.%m.%Y %H:%M")
+
+def task_changed(user_id, task_id, created=False):
+    """Updates the statistics, deadline index and reminders after a task was created, edited, completed or removed"""
+    tasks.count(tasks[user_id].count_task(task_id, clock.now(), created))
+    tasks[user_id].index_deadline(task_id)
+    inline_cache.invalidate(user_id)
+    schedule_reminder(user_id, task_id)
+
+def schedule_reminder(user_id, task_id, first_stage=0, now=None):
+    """Puts the next reminder stage of the task into the reminder index"""
+    key = (current_bot_id.get(), user_id, task_id)
+    task = tasks[user_id].get(task_id)
+    if task is None or task["completed"]:
+        reminder_index.cancel(key)
+        return
+    
+    try:
+        deadline = parse_deadline(task["deadline"])
+    except ValueError:
+        reminder_index.cancel(key)
+        return
+    
+    offsets = get_reminder_offsets(tasks[user_id], task)
+    schedule_stage(
+        key, deadline.timestamp(), offsets, first_stage, (now or clock.now()).timestamp(), task.get("overdue", False)
+    )
+
+# Interned offset tuples, so tasks with the same reminders share one tuple in the index
+reminder_offset_sets = {}
+
+def normalize_offsets(offsets):
+    """Returns the offsets as a shared tuple, largest offset (earliest reminder) first"""
+    offsets = tuple(sorted(set(offsets), reverse=True))
+    return reminder_offset_sets.setdefault(offsets, offsets)
+
+def get_reminder_offsets(user_tasks, task):
+    """Reminder offsets of the task: its own, the chat's default or DEFAULT_REMINDER_OFFSETS"""
+    offsets = task.get("offsets")
+    if offsets is None:
+        offsets = user_tasks.offsets
+    if offsets is None:
+        offsets = DEFAULT_REMINDER_OFFSETS
+    return normalize_offsets(offsets)
+
+def schedule_stage(key, deadline_ts, offsets, first_stage, now_ts, overdue=False, grace=REMINDER_GRACE):
+    """Schedules the first stage starting from first_stage that was not missed by more than grace.
+    
+    The last stage (number len(offsets)) sends nothing and marks the task as overdue at its deadline;
+    it is never missed, so tasks whose deadline passed while the bot was down are counted too.
+    """
+    grace = grace.total_seconds()
+    for stage in range(first_stage, len(offsets)):
+        fire_ts = deadline_ts - offsets[stage]
+        if fire_ts >= now_ts - grace:
+            reminder_index.schedule(key, fire_ts, deadline_ts, offsets, stage)
+            return
+    if overdue:
+        reminder_index.cancel(key)
+    else:
+        reminder_index.schedule(key, deadline_ts, deadline_ts, offsets, len(offsets))
+
+def format_offset(seconds):
+    """Formats a reminder offset for buttons (e.g. 3d, 2h, 15m)"""
+    if seconds == 0:
+        return "at deadline"
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds % size == 0:
+            return f"{seconds // size}{unit}"
+    return f"{seconds}s"
+
+def describe_reminders(offsets):
+    """Describes when reminders come, e.g. "1d, 1h and 5m before the deadline and at the deadline" """
+    before = [format_offset(offset) for offset in offsets if offset]
+    parts = []
+    if before:
+        joined = ", ".join(before[:-1]) + " and " + before[-1] if len(before) > 1 else before[0]
+        parts.append(f"{joined} before the deadline")
+    if 0 in offsets:
+        parts.append("at the deadline")
+    return " and ".join(parts)
+
+def get_reminders_notice(user_id, task_id):
+    """Tells when reminders for a new task come"""
+    user_tasks = tasks[user_id]
+    when = describe_reminders(get_reminder_offsets(user_tasks, user_tasks[task_id]))
+    return f"I will remind you {when}." if when else "Reminders are off for this task."
+
+def archive_task(user_id, task_id):
+    """Moves a task from the working set to cold storage"""
+    task = dict(tasks[user_id][task_id])
+    # What the task still contributes to the statistics, put back on restore so it is not counted twice
+    task["counted"] = [0, 0, *UserTasks.task_counters(task)[2:]]
+    # Reminder bookkeeping is useless for archived tasks
+    task.pop("reminded_at", None)
+    task.pop("reminded", None)
+    task.pop("restored_at", None)
+    data = json.dumps(task, ensure_ascii=False, separators=(",", ":")).encode()
+    # Stored first, so a failed write leaves the task where it was
+    tasks.archive_put(user_id, task_id, zlib.compress(data))
+    del tasks[user_id][task_id]
+    task_changed(user_id, task_id)
+
+def load_archived_task(user_id, task_id):
+    """Decodes a task from cold storage, returns None if there is no such task"""
+    data = tasks.archive_get(user_id, task_id)
+    return json.loads(zlib.decompress(data)) if data is not None else None
+
+def restore_task(user_id, task_id):
+    """Moves a task from cold storage back to the working set, keeping its completion state"""
+    task = load_archived_task(user_id, task_id)
+    tasks.archive_delete(user_id, task_id)
+    # The archiver counts its waiting period from the restore again
+    task["restored_at"] = clock.now().strftime("%d.%m.%Y %H:%M")
+    # Tasks archived before statistics were kept (they have no on_time flag) were never counted
+    counted = task.pop("counted", None)
+    if counted is None:
+        counted = [0, 0, *UserTasks.task_counters(task)[2:]] if "on_time" in task else [0, 0, 0, 0]
+    if user_id not in tasks:
+        tasks[user_id] = UserTasks()
+    tasks[user_id][task_id] = task
+    tasks[user_id].counted[task_id] = tuple(counted)
+    task_changed(user_id, task_id)
+    return task
+
+def add_snooze_buttons(kb, user_id, task_id):
+    """Adds a row of snooze buttons for a reminder"""
+    for choice, (text, _) in SNOOZE_CHOICES.items():
+        kb.button(text=text, callback_data=f"snooze_{user_id}_{task_id}_{choice}")
+    return len(SNOOZE_CHOICES)
+
+def get_task_keyboard(user_id, task_id=None, snooze=False):
     kb = InlineKeyboardBuilder()
     
     if task_id is not None:
+        # Snooze buttons for reminders
+        snooze_row = [add_snooze_buttons(kb, user_id, task_id)] if snooze else []
+        
         # Buttons for a specific task
         kb.button(text="✅ Completed", callback_data=f"complete_{task_id}")
         kb.button(text="✏️ Edit", callback_data=f"edit_{task_id}")
         kb.button(text="🗑️ Delete", callback_data=f"delete_{task_id}")
+        kb.button(text="🔔 Reminders", callback_data=f"remind_{task_id}")
         kb.button(text="« Back", callback_data="list_tasks")
-        kb.adjust(2, 2)
+        # Group chat IDs are negative
+        if user_id < 0:
+            kb.button(text="🙋 Join / Leave", callback_data=f"join_{task_id}")
+            kb.adjust(*snooze_row, 2, 2, 1, 1)
+        else:
+            kb.adjust(*snooze_row, 2, 2, 1)
     else:
         # Show user's task list
+        layout = []
         if user_id in tasks and tasks[user_id]:
             for task_id, task in tasks[user_id].items():
                 status = "✅" if task["completed"] else "⏳"
@@ -55,12 +1513,224 @@ def get_task_keyboard(user_id, task_id=None):
                     text=f"{status} {task['name']} ({task['deadline']})",
                     callback_data=f"view_{task_id}"
                 )
-            kb.adjust(1)
+                layout.append(1)
+            # Agenda views
+            kb.button(text="📅 Today", callback_data="agenda_today")
+            kb.button(text="🗓 Week", callback_data="agenda_week")
+            kb.button(text="⚠️ Overdue", callback_data="agenda_overdue")
+            layout.append(3)
         kb.button(text="➕ Add Task", callback_data="add_task")
-        kb.adjust(1)
+        layout.append(1)
+        if tasks.archive_count(user_id):
+            kb.button(text="🗄 Archive", callback_data="archive_page_0")
+            layout.append(1)
+        kb.adjust(*layout)
+    
+    return kb.as_markup()
+
+def get_offsets_keyboard(offsets, toggle_prefix, back_data, save_data=None):
+    """Creates a keyboard for choosing reminder offsets, chosen ones are checked"""
+    kb = InlineKeyboardBuilder()
+    for offset in REMINDER_OFFSET_CHOICES:
+        mark = "✅" if offset in offsets else "▫️"
+        kb.button(text=f"{mark} {format_offset(offset)}", callback_data=f"{toggle_prefix}_{offset}")
+    
+    layout = [4, 4]
+    if save_data is not None:
+        kb.button(text="💾 Use as my default", callback_data=save_data)
+        layout.append(1)
+    kb.button(text="« Back", callback_data=back_data)
+    layout.append(1)
+    kb.adjust(*layout)
+    return kb.as_markup()
+
+def toggle_offset(offsets, offset):
+    """Returns the offsets with the given offset added or removed"""
+    if offset in offsets:
+        return [o for o in offsets if o != offset]
+    return list(offsets) + [offset]
+
+def set_default_offsets(user_id, offsets):
+    """Changes the chat's default reminder offsets and reschedules tasks that use them"""
+    if user_id not in tasks:
+        tasks[user_id] = UserTasks()
+    tasks[user_id].offsets = list(normalize_offsets(offsets))
+    for task_id, task in tasks[user_id].items():
+        if "offsets" not in task:
+            schedule_reminder(user_id, task_id)
+
+def get_assignee_keyboard(chat_id, task_id):
+    """Creates a keyboard for a shared task reminder sent to an assignee's private chat"""
+    kb = InlineKeyboardBuilder()
+    snooze_row = add_snooze_buttons(kb, chat_id, task_id)
+    kb.button(text="✅ Done", callback_data=f"gdone_{chat_id}_{task_id}")
+    kb.adjust(snooze_row, 1)
+    return kb.as_markup()
+
+def toggle_completed(task, user_id):
+    """Toggles completion of the task by the user, returns whether the user's part is now done.
+    
+    An assignee of a shared task toggles only their own bit; the task is completed when all assignees are done.
+    """
+    assignees = task.get("assignees")
+    if assignees and user_id in assignees:
+        task["done"] = task.get("done", 0) ^ (1 << assignees.index(user_id))
+        done = bool(task["done"] >> assignees.index(user_id) & 1)
+        completed = task["done"] == (1 << len(assignees)) - 1
+    else:
+        done = completed = not task["completed"]
+        if assignees:
+            task["done"] = (1 << len(assignees)) - 1 if completed else 0
+    
+    task["completed"] = completed
+    if completed:
+        task["completed_at"] = clock.now().strftime("%d.%m.%Y %H:%M")
+    else:
+        task.pop("completed_at", None)
+    return done
+
+def toggle_assignee(task, user_id):
+    """Adds the user to the assignees of a shared task or removes them, returns whether the user joined"""
+    assignees = task.setdefault("assignees", [])
+    done = task.get("done", 0)
+    if user_id in assignees:
+        # Drop the user's bit and shift the bits of later assignees down
+        index = assignees.index(user_id)
+        assignees.pop(index)
+        task["done"] = (done & ((1 << index) - 1)) | (done >> (index + 1) << index)
+        joined = False
+    else:
+        assignees.append(user_id)
+        joined = True
+    
+    if not assignees:
+        del task["assignees"]
+        task.pop("done", None)
+    return joined
+
+def get_task_card(task):
+    """Builds the text of a task card"""
+    status = "✅ Completed" if task["completed"] else "⏳ In Progress"
+    
+    # Get deadline information
+    time_status = ""
+    if not task["completed"]:
+        try:
+            deadline = parse_deadline(task["deadline"])
+            
+            # Calculate remaining time
+            time_diff = deadline - clock.now()
+            
+            if time_diff.total_seconds() < 0:
+                time_status = "⚠️ <b>Deadline passed</b>"
+            else:
+                days = time_diff.days
+                hours, remainder = divmod(time_diff.seconds, 3600)
+                minutes, _ = divmod(remainder, 60)
+                
+                if days > 0:
+                    time_status = f"⏳ Remaining: {days} d. {hours} h. {minutes} min."
+                elif hours > 0:
+                    time_status = f"⏳ Remaining: {hours} h. {minutes} min."
+                else:
+                    time_status = f"⏳ Remaining: {minutes} min."
+        except ValueError:
+            time_status = ""
+    
+    # Progress of a shared task
+    assignees = task.get("assignees")
+    if assignees:
+        done_count = bin(task.get("done", 0)).count("1")
+        time_status += f"\n👥 Done: {done_count} of {len(assignees)}"
+    
+    return (
+        f"🔹 <b>{task['name']}</b>\n\n"
+        f"Status: {status}\n"
+        f"Deadline: {task['deadline']}\n"
+        f"{time_status}\n"
+        f"Created: {task['created_at']}"
+    )
+
+def get_inline_task_keyboard(user_id, task_id):
+    """Creates a keyboard for a task shared through inline mode"""
+    task = tasks[user_id][task_id]
+    kb = InlineKeyboardBuilder()
+    kb.button(
+        text="↩️ Undo" if task["completed"] else "✅ Complete",
+        callback_data=f"icomplete_{user_id}_{task_id}"
+    )
+    kb.button(text="↗️ Share", switch_inline_query=task["name"])
+    kb.adjust(2)
+    return kb.as_markup()
+
+def get_agenda(user_id, view):
+    """Returns the title and IDs of tasks for the "today", "week" or "overdue" agenda view"""
+    now = clock.now()
+    if view == "today":
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        start_ts, end_ts = start.timestamp(), (start + timedelta(days=1)).timestamp()
+        title = "📅 <b>Due today:</b>"
+    elif view == "week":
+        start_ts, end_ts = now.timestamp(), (now + timedelta(days=7)).timestamp()
+        title = "🗓 <b>Due this week:</b>"
+    else:
+        start_ts, end_ts = float("-inf"), now.timestamp()
+        title = "⚠️ <b>Overdue:</b>"
     
+    if user_id not in tasks:
+        return title, []
+    return title, tasks[user_id].due_between(start_ts, end_ts)
+
+def get_agenda_keyboard(user_id, task_ids):
+    """Creates a keyboard with the tasks of an agenda view"""
+    kb = InlineKeyboardBuilder()
+    for task_id in task_ids:
+        task = tasks[user_id][task_id]
+        kb.button(
+            text=f"⏳ {task['name']} ({task['deadline']})",
+            callback_data=f"view_{task_id}"
+        )
+    kb.button(text="« Back to Tasks", callback_data="list_tasks")
+    kb.adjust(1)
     return kb.as_markup()
 
+def percent(part, whole):
+    return f"{round(100 * part / whole)}%" if whole else "—"
+
+def format_stats(stats):
+    """Returns the lines describing task statistics counters"""
+    created = stats.get("created", 0)
+    completed = stats.get("completed", 0)
+    return [
+        f"Tasks created: {created}",
+        f"Completed: {completed} ({percent(completed, created)})",
+        f"Completed on time: {stats.get('on_time', 0)} ({percent(stats.get('on_time', 0), completed)})",
+        f"Open: {stats.get('open', 0)}, overdue: {stats.get('overdue', 0)}",
+    ]
+
+def get_stats_text(user_id):
+    """Returns the statistics of the chat's tasks"""
+    stats = tasks[user_id].stats if user_id in tasks else {}
+    # The streak is broken if nothing was completed yesterday or today
+    streak = stats.get("streak", 0)
+    if stats.get("streak_day", 0) < clock.now().toordinal() - 1:
+        streak = 0
+    lines = format_stats(stats)
+    lines.append(f"Streak: {streak} day{'s' if streak != 1 else ''} (best: {stats.get('best_streak', 0)})")
+    return "📊 <b>Your statistics</b>\n\n" + "\n".join(lines)
+
+def get_fleet_stats_text():
+    """Returns the statistics of all chats of all bots"""
+    total = {}
+    sections = []
+    for bot_id, stats in sorted(tasks.fleet.items()):
+        for name, value in stats.items():
+            total[name] = total.get(name, 0) + value
+        sections.append(f"<b>Bot {bot_id}</b>\nChats: {stats.get('users', 0)}\n" + "\n".join(format_stats(stats)))
+    if len(sections) > 1:
+        sections.append(f"<b>Total</b>\nChats: {total.get('users', 0)}\n" + "\n".join(format_stats(total)))
+    return "📊 <b>Fleet statistics</b>\n\n" + "\n\n".join(sections or ["No tasks yet"])
+
 def get_main_keyboard():
     # Create a keyboard with main commands
     keyboard = ReplyKeyboardMarkup(
@@ -72,106 +1742,405 @@ def get_main_keyboard():
     )
     return keyboard
 
-async def send_reminder(user_id, task_id, time_until_deadline):
-    """Sends a reminder about the task"""
-    if user_id in tasks and task_id in tasks[user_id]:
-        task = tasks[user_id][task_id]
+def render_reminder(task, time_until_deadline):
+    """Returns the reminder text for the task for the given time until its deadline"""
+    seconds = int(time_until_deadline.total_seconds())
+    if seconds <= 0:  # At deadline moment
+        return (
+            f"🔔 <b>Time's up!</b>\n\n"
+            f"Task <b>{task['name']}</b> is due now\n"
+            f"Deadline: {task['deadline']}"
+        )
+    
+    # Describe the offset in the largest whole unit
+    for unit, size in (("day", 86400), ("hour", 3600), ("minute", 60)):
+        if seconds >= size:
+            amount = round(seconds / size)
+            break
+    else:
+        unit, amount = "minute", 1
+    due_in = f"{amount} {unit}{'s' if amount > 1 else ''}"
+    
+    if seconds <= URGENT_REMINDER_OFFSET:
+        header = "⚠️ <b>Urgent Reminder!</b>"
+    else:
+        header = "⏰ <b>Reminder!</b>"
+    return (
+        f"{header}\n\n"
+        f"Task <b>{task['name']}</b> is due in {due_in}\n"
+        f"Deadline: {task['deadline']}"
+    )
+
+def queue_reminder(bot_id, user_id, task_id, time_until_deadline):
+    """Renders a reminder once and puts it into the send queue for every recipient"""
+    token = current_bot_id.set(bot_id)
+    try:
+        _queue_reminder(bot_id, user_id, task_id, time_until_deadline)
+    finally:
+        current_bot_id.reset(token)
+
+def _queue_reminder(bot_id, user_id, task_id, time_until_deadline):
+    if user_id not in tasks or task_id not in tasks[user_id]:
+        return
+    task = tasks[user_id][task_id]
+    
+    # Check that the task is not marked as completed
+    if task["completed"]:
+        return
+    
+    message = render_reminder(task, time_until_deadline)
+    
+    assignees = task.get("assignees")
+    if assignees:
+        # Shared task: a direct message to every assignee who is not done yet
+        reply_markup = get_assignee_keyboard(user_id, task_id)
+        done = task.get("done", 0)
+        recipients = [assignee for index, assignee in enumerate(assignees) if not done >> index & 1]
+    else:
+        reply_markup = get_task_keyboard(user_id, task_id, snooze=True)
+        recipients = [user_id]
+    
+    # Every stage goes to every recipient once, whichever replica fires it
+    try:
+        deadline_ts = int(parse_deadline(task["deadline"]).timestamp())
+    except ValueError:
+        return
+    offset = int(time_until_deadline.total_seconds())
+    for recipient in recipients:
+        key = f"{bot_id}:{user_id}:{task_id}:{deadline_ts}:{offset}:{recipient}"
+        reminder_outbox.append((bot_id, recipient, message, reply_markup, key))
+    
+    # Update reminder flag for this interval
+    if not "reminded_at" in task:
+        task["reminded_at"] = []
         
-        # Check that the task is not marked as completed
-        if not task["completed"]:
-            # Determine the message depending on the time until deadline
-            if time_until_deadline.days == 1:  # 24 hours before
-                message = (
-                    f"⏰ <b>Reminder!</b>\n\n"
-                    f"Task <b>{task['name']}</b> is due in 24 hours\n"
-                    f"Deadline: {task['deadline']}"
-                )
-            elif time_until_deadline.seconds <= 3600 and time_until_deadline.seconds > 300:  # 1 hour before
-                message = (
-                    f"⏰ <b>Reminder!</b>\n\n"
-                    f"Task <b>{task['name']}</b> is due in 1 hour\n"
-                    f"Deadline: {task['deadline']}"
-                )
-            elif time_until_deadline.seconds <= 300 and time_until_deadline.seconds > 0:  # 5 minutes before
-                message = (
-                    f"⚠️ <b>Urgent Reminder!</b>\n\n"
-                    f"Task <b>{task['name']}</b> is due in 5 minutes\n"
-                    f"Deadline: {task['deadline']}"
+    # Add current time to the list of sent reminders
+    task["reminded_at"].append(clock.now().strftime("%d.%m.%Y %H:%M"))
+
+def queue_claimed_reminders():
+    """Claims the reminders of a fired batch at once and queues the ones that were not sent yet"""
+    claimed = sent_reminders.claim([item[4] for item in reminder_outbox])
+    for item in reminder_outbox:
+        if item[4] in claimed:
+            reminder_queue.put_nowait(item)
+    reminder_outbox.clear()
+
+def queue_snoozed_reminder(bot_id, user_id, task_id, recipient):
+    """Puts a snoozed reminder into the send queue if the task still needs it"""
+    token = current_bot_id.set(bot_id)
+    try:
+        _queue_snoozed_reminder(bot_id, user_id, task_id, recipient)
+    finally:
+        current_bot_id.reset(token)
+
+def _queue_snoozed_reminder(bot_id, user_id, task_id, recipient):
+    if user_id not in tasks or task_id not in tasks[user_id]:
+        return
+    task = tasks[user_id][task_id]
+    snoozes = task.get("snoozes", {})
+    snoozes.pop(str(recipient), None)
+    if not snoozes:
+        task.pop("snoozes", None)
+    if task["completed"]:
+        return
+    
+    try:
+        time_until_deadline = parse_deadline(task["deadline"]) - clock.now()
+    except ValueError:
+        return
+    message = "💤 " + render_reminder(task, time_until_deadline)
+    
+    if recipient == user_id:
+        reply_markup = get_task_keyboard(user_id, task_id, snooze=True)
+    else:
+        # An assignee of a shared task
+        if recipient not in task.get("assignees", []):
+            return
+        reply_markup = get_assignee_keyboard(user_id, task_id)
+    reminder_queue.put_nowait((bot_id, recipient, message, reply_markup, None))
+
+def mark_overdue(bot_id, user_id, task_id):
+    """Counts an unfinished task as overdue once its deadline passes"""
+    token = current_bot_id.set(bot_id)
+    try:
+        if user_id not in tasks or task_id not in tasks[user_id]:
+            return
+        task = tasks[user_id][task_id]
+        if task["completed"]:
+            return
+        task["overdue"] = True
+        tasks.count(tasks[user_id].count_task(task_id, clock.now()))
+    finally:
+        current_bot_id.reset(token)
+
+def snooze_reminder(user_id, task_id, recipient, choice):
+    """Schedules a one-off reminder for the recipient, replacing their pending snooze of the task.
+    
+    Returns the time of the snoozed reminder.
+    """
+    now = clock.now()
+    delay = SNOOZE_CHOICES[choice][1]
+    if delay is None:
+        fire_at = (now + timedelta(days=1)).replace(hour=SNOOZE_TOMORROW_HOUR, minute=0, second=0, microsecond=0)
+    else:
+        fire_at = now + timedelta(seconds=delay)
+    # Kept with the task, so the snooze survives a restart or a change of leader
+    task = tasks[user_id].get(task_id)
+    if task is not None:
+        task.setdefault("snoozes", {})[str(recipient)] = fire_at.timestamp()
+    key = (current_bot_id.get(), user_id, task_id, recipient)
+    reminder_index.schedule(key, fire_at.timestamp(), None, None, None)
+    return fire_at
+
+async def reminder_worker():
+    """Sends queued reminders in the background lane of the bot they belong to"""
+    current_lane.set("background")
+    while True:
+        bot_id, chat_id, message, reply_markup, key = await reminder_queue.get()
+        sent = False
+        try:
+            # After losing the lease, unsent reminders are left to whichever replica leads next
+            if lease.held():
+                await bots[bot_id].send_message(
+                    chat_id, message, parse_mode="HTML", reply_markup=reply_markup,
+                    request_timeout=REMINDER_SEND_TIMEOUT
                 )
-            elif time_until_deadline.total_seconds() <= 0:  # At deadline moment
-                message = (
-                    f"🔔 <b>Time's up!</b>\n\n"
-                    f"Task <b>{task['name']}</b> is due now\n"
-                    f"Deadline: {task['deadline']}"
+                sent = True
+        except LeaseLost:
+            pass
+        except Exception:
+            logging.exception("Failed to send reminder to chat %s", chat_id)
+        finally:
+            if key is not None:
+                if sent:
+                    sent_reminders.mark_sent(key)
+                else:
+                    sent_reminders.release(key)
+            reminder_queue.task_done()
+
+def load_reminder_index(catch_up=REMINDER_GRACE):
+    """Builds the reminder index from all stored tasks, including stages missed by no more than catch_up"""
+    for _ in load_reminder_index_steps(catch_up):
+        pass
+
+def load_reminder_index_steps(catch_up=REMINDER_GRACE):
+    """Builds the reminder index like load_reminder_index, one chunk of task sets per step"""
+    now = clock.now()
+    for chunk in tasks.iter_chunks():
+        for (bot_id, user_id), user_tasks in chunk:
+            for task_id, task in user_tasks.items():
+                if task["completed"]:
+                    continue
+                try:
+                    deadline = parse_deadline(task["deadline"])
+                except ValueError:
+                    continue
+                offsets = get_reminder_offsets(user_tasks, task)
+                schedule_stage(
+                    (bot_id, user_id, task_id), deadline.timestamp(), offsets, 0, now.timestamp(),
+                    task.get("overdue", False), catch_up
                 )
+                # Snoozes that came due while no replica was leading fire at once
+                for recipient, fire_ts in task.get("snoozes", {}).items():
+                    reminder_index.schedule((bot_id, user_id, task_id, int(recipient)), fire_ts, None, None, None)
+        yield
+    logging.info("Reminder index loaded: %d tasks", len(reminder_index.pending))
+
+def fire_due_reminders(fire, deadline_passed, page_in=None, limit=None):
+    """Hands due reminder stages (at most limit) to fire(bot_id, user_id, task_id, time_until_deadline).
+    
+    Passed deadlines go to deadline_passed(bot_id, user_id, task_id). page_in, if given, receives
+    the (bot_id, user_id) keys of the batch before the fires, so their tasks are loaded at once.
+    Returns the number of seconds until the next fire (at most REMINDER_MAX_SLEEP).
+    """
+    now_ts = clock.now().timestamp()
+    due = reminder_index.pop_due(now_ts, limit)
+    done = 0
+    try:
+        if page_in is not None:
+            page_in({key[:2] for key, _, _, _ in due})
+        
+        for key, deadline_ts, offsets, stage in due:
+            if offsets is None:
+                # One-off snooze
+                queue_snoozed_reminder(*key)
+            elif stage == len(offsets):
+                deadline_passed(*key)
             else:
-                return  # Don't send reminders for other intervals
-            
-            # Send reminder
-            await bot.send_message(
-                user_id,
-                message,
-                parse_mode="HTML",
-                reply_markup=get_task_keyboard(user_id, task_id)
-            )
-            
-            # Update reminder flag for this interval
-            if not "reminded_at" in task:
-                task["reminded_at"] = []
-                
-            # Add current time to the list of sent reminders
-            task["reminded_at"].append(datetime.now().strftime("%d.%m.%Y %H:%M"))
+                fire(*key, timedelta(seconds=offsets[stage]))
+                # Schedule the next stage of the task
+                schedule_stage(key, deadline_ts, offsets, stage + 1, now_ts)
+            done += 1
+    except sqlite3.Error:
+        # Fires that were not handed out go back into the index, so they are retried
+        for key, deadline_ts, offsets, stage in due[done:]:
+            reminder_index.schedule(key, now_ts, deadline_ts, offsets, stage)
+        raise
+    
+    next_fire = reminder_index.next_fire()
+    if next_fire is None:
+        return REMINDER_MAX_SLEEP
+    return min(REMINDER_MAX_SLEEP, max(0, next_fire - clock.now().timestamp()))
 
 async def check_deadlines():
-    """Periodically checks deadlines and sends reminders"""
+    """Sends reminders as their fire times come, using the reminder index"""
     while True:
-        now = datetime.now()
+        try:
+            timeout = fire_due_reminders(queue_reminder, mark_overdue, tasks.page_in, REMINDER_BATCH_SIZE)
+            queue_claimed_reminders()
+        except sqlite3.Error:
+            # Unfired stages are back in the index and unclaimed reminders stay in the outbox
+            logging.exception("Failed to fire reminders")
+            await clock.sleep(REMINDER_RETRY_DELAY)
+            continue
+        if timeout == 0:
+            # More fires are due; let handlers run before the next batch
+            await asyncio.sleep(0)
+            continue
         
-        for user_id in tasks:
-            for task_id, task in list(tasks[user_id].items()):
-                # Skip completed tasks
-                if task.get("completed"):
-                    continue
-                
+        # Sleep until the next fire or until an earlier one is scheduled
+        reminder_index.wakeup.clear()
+        await clock.wait(reminder_index.wakeup, timeout)
+
+async def lead():
+    """Handles updates and reminders while this replica holds the lease.
+    
+    Other replicas stand by without polling Telegram or keeping tasks in memory,
+    so only the leader ever changes tasks and reminders.
+    """
+    background = None
+    while True:
+        if background is not None and any(task.done() for task in background.values()):
+            # A leader that cannot do its work gives the lease to another replica
+            for name, task in background.items():
+                if task.done() and not task.cancelled() and task.exception() is not None:
+                    logging.error("Background task %s failed", name, exc_info=task.exception())
+            logging.warning("Background tasks of %s stopped, releasing the lease", REPLICA_ID)
+            await stop_background_tasks(background)
+            background = None
+            lease.release()
+            await asyncio.sleep(LEASE_TTL)
+            continue
+        
+        if lease.renew():
+            if background is None:
+                logging.info("Lease acquired by %s", REPLICA_ID)
                 try:
-                    # Determine date format
-                    if len(task["deadline"].split()) == 1:
-                        # Only date (add 23:59)
-                        deadline = datetime.strptime(f"{task['deadline']} 23:59", "%d.%m.%Y %H:%M")
-                    else:
-                        # Date and time
-                        deadline = datetime.strptime(task["deadline"], "%d.%m.%Y %H:%M")
-                    
-                    # Calculate time until deadline
-                    time_diff = deadline - now
-                    
-                    # List of reminders that have already been sent
-                    reminded_at = task.get("reminded_at", [])
-                    
-                    # Check different intervals for reminders
-                    
-                    # 24 hours before (check that the reminder has not been sent yet)
-                    if time_diff.days == 1 and now.strftime("%d.%m.%Y") not in "".join(reminded_at):
-                        await send_reminder(user_id, task_id, time_diff)
-                    
-                    # 1 hour before (check that the reminder has not been sent in the current hour)
-                    elif time_diff.seconds <= 3600 and time_diff.seconds > 3540 and now.strftime("%d.%m.%Y %H") not in "".join(reminded_at):
-                        await send_reminder(user_id, task_id, time_diff)
-                    
-                    # 5 minutes before (check that the reminder has not been sent in the current 5 minutes)
-                    elif time_diff.seconds <= 300 and time_diff.seconds > 240 and now.strftime("%d.%m.%Y %H:%M") not in "".join(reminded_at):
-                        await send_reminder(user_id, task_id, time_diff)
-                    
-                    # At deadline moment (± 1 minute)
-                    elif abs(time_diff.total_seconds()) < 60 and now.strftime("%d.%m.%Y %H:%M") not in "".join(reminded_at):
-                        await send_reminder(user_id, task_id, time_diff)
-                    
-                except ValueError:
-                    # Date format error - skip
+                    background = await start_background_tasks()
+                except sqlite3.Error:
+                    logging.exception("Failed to load tasks")
+                if background is None:
+                    # Another replica may do better
+                    tasks.reset()
+                    reminder_index.clear()
+                    lease.release()
+                    await asyncio.sleep(LEASE_TTL)
                     continue
+        elif background is not None:
+            logging.warning("Lease lost by %s", REPLICA_ID)
+            await stop_background_tasks(background)
+            background = None
+        await asyncio.sleep(LEASE_RENEW_INTERVAL)
+
+def simulate(duration, task_count, complete_share=0.1, seed=0):
+    """Runs the reminder scheduler on a virtual clock and reports missed, late and duplicate reminders.
+    
+    Deadlines are spread evenly over the simulated period plus one day; a quarter of the tasks has
+    custom reminder offsets and complete_share of them is completed at a random moment.
+    Lateness includes the CPU time the reminder index takes; fires go to a counter instead of
+    queue_reminder, so loading tasks from the database, rendering and sent reminder claims are not measured.
+    """
+    global clock, reminder_index
+    rng = random.Random(seed)
+    start = datetime.now().replace(second=0, microsecond=0)
+    clock = VirtualClock(start)
+    reminder_index = ReminderIndex()
+    start_ts = start.timestamp()
+    end_ts = start_ts + duration.total_seconds()
+    grace = REMINDER_GRACE.total_seconds()
+    # Delivered reminders are counted per offset choice
+    choice_index = {offset: index for index, offset in enumerate(REMINDER_OFFSET_CHOICES)}
+    
+    # Tasks with minute-aligned deadlines; completions are applied as the clock passes them
+    horizon_minutes = int((duration + timedelta(days=1)).total_seconds() // 60)
+    deadlines = [start_ts + 60 * rng.randint(1, horizon_minutes) for _ in range(task_count)]
+    default_offsets = normalize_offsets(DEFAULT_REMINDER_OFFSETS)
+    custom_offsets = [
+        normalize_offsets(rng.sample(REMINDER_OFFSET_CHOICES, rng.randint(1, len(REMINDER_OFFSET_CHOICES))))
+        for _ in range(16)
+    ]
+    task_offsets = [
+        rng.choice(custom_offsets) if rng.random() < 0.25 else default_offsets
+        for _ in range(task_count)
+    ]
+    completions = sorted(
+        (start_ts + rng.uniform(0, duration.total_seconds()), task_index)
+        for task_index in rng.sample(range(task_count), int(task_count * complete_share))
+    )
+    completed_at = {task_index: completed_ts for completed_ts, task_index in completions}
+    
+    setup_cpu = time.process_time()
+    for task_index, deadline_ts in enumerate(deadlines):
+        schedule_stage((0, 0, task_index), deadline_ts, task_offsets[task_index], 0, start_ts)
+    setup_cpu = time.process_time() - setup_cpu
+    
+    # Delivered reminders: sent[choice_index[offset]][task_index] = count
+    sent = [bytearray(task_count) for _ in REMINDER_OFFSET_CHOICES]
+    late = 0
+    max_lateness = 0.0
+    hourly = {}
+    
+    def record(bot_id, user_id, task_index, time_until_deadline):
+        nonlocal late, max_lateness
+        offset = time_until_deadline.total_seconds()
+        counts = sent[choice_index[offset]]
+        counts[task_index] = min(255, counts[task_index] + 1)
+        lateness = clock.now().timestamp() - (deadlines[task_index] - offset)
+        max_lateness = max(max_lateness, lateness)
+        if lateness > grace:
+            late += 1
+    
+    next_completion = 0
+    while clock.now().timestamp() < end_ts:
+        now_ts = clock.now().timestamp()
+        while next_completion < len(completions) and completions[next_completion][0] <= now_ts:
+            reminder_index.cancel((0, 0, completions[next_completion][1]))
+            next_completion += 1
+        
+        cpu = time.process_time()
+        timeout = fire_due_reminders(record, lambda *key: None)
+        cpu = time.process_time() - cpu
+        hour = int((now_ts - start_ts) // 3600)
+        hourly[hour] = hourly.get(hour, 0) + cpu
         
-        # Check every 30 seconds
-        await asyncio.sleep(30)
+        # The real loop would have spent the CPU time before sleeping again
+        clock.advance(cpu)
+        if next_completion < len(completions):
+            timeout = min(timeout, max(0, completions[next_completion][0] - clock.now().timestamp()))
+        clock.advance(max(timeout, 0.001))
+    
+    # Compare with the reminders every task should have received
+    missed = duplicates = expected_total = 0
+    for task_index, deadline_ts in enumerate(deadlines):
+        stop_ts = min(end_ts, completed_at.get(task_index, end_ts))
+        for offset in task_offsets[task_index]:
+            fire_ts = deadline_ts - offset
+            if start_ts - grace <= fire_ts < stop_ts:
+                expected_total += 1
+                if sent[choice_index[offset]][task_index] == 0:
+                    missed += 1
+        for counts in sent:
+            if counts[task_index] > 1:
+                duplicates += counts[task_index] - 1
+    
+    print(f"Simulated {duration} with {task_count} tasks ({len(completions)} completed on the way)")
+    print(f"Index build CPU: {setup_cpu:.2f} s")
+    print(f"Reminders expected: {expected_total}, sent: {sum(sum(stage) for stage in sent)}")
+    print(f"Missed: {missed}, late (> {REMINDER_GRACE}): {late}, duplicates: {duplicates}")
+    print(f"Max lateness: {max_lateness:.3f} s")
+    print("Reminder index CPU per simulated hour (without task loading, rendering and sent reminder claims):")
+    for hour in sorted(hourly):
+        print(f"  hour {hour:4d}: {hourly[hour] * 1000:9.1f} ms")
 
 # /start command handler
 @dp.message(CommandStart())
@@ -180,6 +2149,9 @@ async def cmd_start(message: Message):
         "👋 Hello! I'm a scheduler bot that will help you manage your tasks.\n\n"
         "Use the buttons below to manage tasks or the following commands:\n"
         "/tasks - view all tasks\n"
+        "/today, /week, /overdue - view tasks by deadline\n"
+        "/reminders - choose when to be reminded\n"
+        "/stats - your completion statistics\n"
         "/add - add a new task\n"
         "/help - get help",
         reply_markup=get_main_keyboard()
@@ -189,12 +2161,22 @@ async def cmd_start(message: Message):
 @dp.message(Command("help"))
 @dp.message(F.text == "ℹ️ Help")
 async def cmd_help(message: Message):
+    user_id = message.chat.id
+    offsets = tasks[user_id].offsets if user_id in tasks else None
+    if offsets is None:
+        offsets = DEFAULT_REMINDER_OFFSETS
+    when = describe_reminders(normalize_offsets(offsets))
+    
     await message.answer(
         "🔍 <b>Command Help</b>\n\n"
         "📋 My Tasks - view all tasks\n"
+        "/today, /week, /overdue - tasks due today, this week or overdue\n"
+        "/reminders - default reminder times\n"
+        "/stats - completion rate, on-time share and streak\n"
         "➕ Add Task - create a new task\n"
         "ℹ️ Help - show this help\n\n"
-        "The bot will remind you 1 hour before the task is due.",
+        + (f"By default the bot reminds you {when}." if when else "Reminders are off by default.")
+        + " Change it with /reminders or the 🔔 Reminders button of a task.",
         parse_mode="HTML",
         reply_markup=get_main_keyboard()
     )
@@ -203,7 +2185,7 @@ async def cmd_help(message: Message):
 @dp.message(Command("tasks"))
 @dp.message(F.text == "📋 My Tasks")
 async def cmd_tasks(message: Message):
-    user_id = message.from_user.id
+    user_id = message.chat.id
     
     if user_id not in tasks or not tasks[user_id]:
         await message.answer(
@@ -217,13 +2199,78 @@ async def cmd_tasks(message: Message):
             parse_mode="HTML"
         )
 
+# /today, /week and /overdue command handlers
+@dp.message(Command("today", "week", "overdue"))
+async def cmd_agenda(message: Message, command: CommandObject):
+    user_id = message.chat.id
+    title, task_ids = get_agenda(user_id, command.command)
+    
+    await message.answer(
+        title if task_ids else "No tasks here 🎉",
+        reply_markup=get_agenda_keyboard(user_id, task_ids),
+        parse_mode="HTML"
+    )
+
+# /reminders command handler: default reminder offsets for new tasks
+@dp.message(Command("reminders"))
+async def cmd_reminders(message: Message):
+    user_id = message.chat.id
+    offsets = tasks[user_id].offsets if user_id in tasks else None
+    if offsets is None:
+        offsets = DEFAULT_REMINDER_OFFSETS
+    
+    await message.answer(
+        "🔔 Choose when I remind you about tasks by default:",
+        reply_markup=get_offsets_keyboard(offsets, "rdef", "list_tasks")
+    )
+
+# /stats command handler ("/stats fleet" shows all chats to admins)
+@dp.message(Command("stats"))
+async def cmd_stats(message: Message, command: CommandObject):
+    if command.args and command.args.strip() == "fleet" and message.from_user.id in ADMIN_IDS:
+        text = get_fleet_stats_text()
+    else:
+        text = get_stats_text(message.chat.id)
+    await message.answer(text, parse_mode="HTML")
+
 # /add command and "Add Task" button handler
 @dp.message(Command("add"))
 @dp.message(F.text == "➕ Add Task")
-async def cmd_add(message: Message, state: FSMContext):
+async def cmd_add(message: Message, state: FSMContext, command: CommandObject = None):
+    # "/add Pay rent 01.11 18:00" creates the task at once
+    if command is not None and command.args:
+        if await quick_add(message, command.args):
+            return
+        # Only the name was given, go straight to the calendar
+        await state.update_data(task_name=command.args.strip())
+        await message.answer(
+            "Let's choose a deadline for the task. "
+            "Select a date from the calendar:",
+            reply_markup=get_month_keyboard()
+        )
+        await state.set_state(TaskStates.waiting_for_date_selection)
+        return
+    
     await message.answer("Enter the task name:")
     await state.set_state(TaskStates.waiting_for_task_name)
 
+async def quick_add(message: Message, text):
+    """Creates a task from a single message, returns False if the text has no deadline"""
+    parsed = parse_quick_add(text)
+    if parsed is None:
+        return False
+    
+    name, deadline_str = parsed
+    user_id = message.chat.id
+    task_id = create_task(user_id, name, deadline_str)
+    
+    await message.answer(
+        f"✅ Task \"{name}\" with deadline {deadline_str} added!\n"
+        + get_reminders_notice(user_id, task_id),
+        reply_markup=get_task_keyboard(user_id, task_id)
+    )
+    return True
+
 # Task name handler
 @dp.message(TaskStates.waiting_for_task_name)
 async def process_task_name(message: Message, state: FSMContext):
@@ -248,8 +2295,8 @@ def get_month_keyboard():
         "September", "October", "November", "December"
     ]
     
-    current_month = datetime.now().month
-    current_year = datetime.now().year
+    current_month = clock.now().month
+    current_year = clock.now().year
     
     # Add header
     kb.button(text="Select Month", callback_data="ignore")
@@ -340,7 +2387,7 @@ def get_day_keyboard(month, year):
         days_in_month = 31
     
     # Current date
-    current_date = datetime.now().date()
+    current_date = clock.now().date()
     
     # For the current month, show only days starting from today
     start_day = 1
@@ -476,7 +2523,7 @@ async def process_day_selection(callback: CallbackQuery, state: FSMContext):
     await state.update_data(date_str=date_str)
     
     # Check if the selected date is the current day
-    now = datetime.now()
+    now = clock.now()
     is_today = (day == now.day and month == now.month and year == now.year)
     
     # Create keyboard with hours, taking into account the current day
@@ -569,7 +2616,7 @@ async def process_hour_selection(callback: CallbackQuery, state: FSMContext):
     selected_year = int(user_data.get("selected_year"))
     
     # Get current time
-    now = datetime.now()
+    now = clock.now()
     
     # Check if current day and hour are selected
     is_today = (selected_day == now.day and 
@@ -652,7 +2699,7 @@ async def process_exact_time(callback: CallbackQuery, state: FSMContext):
     # Form deadline string
     deadline_str = f"{date_str} {time_str}"
     
-    user_id = callback.from_user.id
+    user_id = callback.message.chat.id
     
     # Check if we're editing an existing task
     is_editing = user_data.get("is_editing", False)
@@ -661,6 +2708,7 @@ async def process_exact_time(callback: CallbackQuery, state: FSMContext):
         # Edit existing task
         edit_task_id = user_data.get("edit_task_id")
         tasks[user_id][edit_task_id]["deadline"] = deadline_str
+        task_changed(user_id, edit_task_id)
         
         await callback.message.edit_text(
             f"✅ Deadline for task \"{tasks[user_id][edit_task_id]['name']}\" "
@@ -669,22 +2717,11 @@ async def process_exact_time(callback: CallbackQuery, state: FSMContext):
         )
     else:
         # Create new task
-        if user_id not in tasks:
-            tasks[user_id] = {}
-        
-        task_id = str(len(tasks[user_id]) + 1)
-        
-        tasks[user_id][task_id] = {
-            "name": task_name,
-            "deadline": deadline_str,
-            "completed": False,
-            "reminded": False,
-            "created_at": datetime.now().strftime("%d.%m.%Y %H:%M")
-        }
+        task_id = create_task(user_id, task_name, deadline_str)
         
         await callback.message.edit_text(
             f"✅ Task \"{task_name}\" with deadline {deadline_str} added!\n"
-            f"I will remind you 1 hour before the deadline.",
+            + get_reminders_notice(user_id, task_id),
             reply_markup=get_task_keyboard(user_id)
         )
     
@@ -695,7 +2732,7 @@ async def process_exact_time(callback: CallbackQuery, state: FSMContext):
 @dp.callback_query(F.data == "list_tasks")
 async def process_list_tasks(callback: CallbackQuery):
     await callback.answer()
-    user_id = callback.from_user.id
+    user_id = callback.message.chat.id
     
     if user_id not in tasks or not tasks[user_id]:
         await callback.message.edit_text(
@@ -709,6 +2746,19 @@ async def process_list_tasks(callback: CallbackQuery):
             parse_mode="HTML"
         )
 
+@dp.callback_query(F.data.startswith("agenda_"))
+async def process_agenda(callback: CallbackQuery):
+    """Shows an agenda view"""
+    await callback.answer()
+    user_id = callback.message.chat.id
+    title, task_ids = get_agenda(user_id, callback.data.split("_")[1])
+    
+    await callback.message.edit_text(
+        title if task_ids else "No tasks here 🎉",
+        reply_markup=get_agenda_keyboard(user_id, task_ids),
+        parse_mode="HTML"
+    )
+
 @dp.callback_query(F.data == "add_task")
 async def process_add_task_button(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
@@ -718,118 +2768,109 @@ async def process_add_task_button(callback: CallbackQuery, state: FSMContext):
 @dp.callback_query(F.data.startswith("view_"))
 async def process_view_task(callback: CallbackQuery):
     await callback.answer()
-    user_id = callback.from_user.id
+    user_id = callback.message.chat.id
     task_id = callback.data.split("_")[1]
     
     if user_id in tasks and task_id in tasks[user_id]:
-        task = tasks[user_id][task_id]
-        status = "✅ Completed" if task["completed"] else "⏳ In Progress"
-        
-        # Get deadline information
-        deadline_text = task["deadline"]
-        
-        try:
-            if len(deadline_text.split()) == 1:
-                # Only date (add 23:59)
-                deadline = datetime.strptime(f"{deadline_text} 23:59", "%d.%m.%Y %H:%M")
-            else:
-                deadline = datetime.strptime(deadline_text, "%d.%m.%Y %H:%M")
-            
-            # Calculate remaining time
-            time_diff = deadline - datetime.now()
-            
-            if time_diff.total_seconds() < 0:
-                time_status = "⚠️ <b>Deadline passed</b>"
-            else:
-                days = time_diff.days
-                hours, remainder = divmod(time_diff.seconds, 3600)
-                minutes, _ = divmod(remainder, 60)
-                
-                if days > 0:
-                    time_status = f"⏳ Remaining: {days} d. {hours} h. {minutes} min."
-                elif hours > 0:
-                    time_status = f"⏳ Remaining: {hours} h. {minutes} min."
-                else:
-                    time_status = f"⏳ Remaining: {minutes} min."
-        except ValueError:
-            time_status = ""
-        
         await callback.message.edit_text(
-            f"🔹 <b>{task['name']}</b>\n\n"
-            f"Status: {status}\n"
-            f"Deadline: {task['deadline']}\n"
-            f"{time_status}\n"
-            f"Created: {task['created_at']}",
+            get_task_card(tasks[user_id][task_id]),
             reply_markup=get_task_keyboard(user_id, task_id),
             parse_mode="HTML"
         )
 
 @dp.callback_query(F.data.startswith("complete_"))
 async def process_complete_task(callback: CallbackQuery):
-    user_id = callback.from_user.id
+    user_id = callback.message.chat.id
     task_id = callback.data.split("_")[1]
     
     if user_id in tasks and task_id in tasks[user_id]:
-        # Toggle task status
-        tasks[user_id][task_id]["completed"] = not tasks[user_id][task_id]["completed"]
-        status = "completed" if tasks[user_id][task_id]["completed"] else "not completed"
+        # Toggle task status (an assignee of a shared task toggles only their own part)
+        task = tasks[user_id][task_id]
+        was_completed = task["completed"]
+        done = toggle_completed(task, callback.from_user.id)
+        if task["completed"] != was_completed:
+            task_changed(user_id, task_id)
+        status = "completed" if done else "not completed"
         
         await callback.answer(f"Task marked as {status}")
         
         # Update message
+        await callback.message.edit_text(
+            get_task_card(task),
+            reply_markup=get_task_keyboard(user_id, task_id),
+            parse_mode="HTML"
+        )
+    else:
+        await callback.answer()
+
+@dp.callback_query(F.data.startswith("join_"))
+async def process_join_task(callback: CallbackQuery):
+    """Adds the user to the assignees of a group task or removes them"""
+    user_id = callback.message.chat.id
+    task_id = callback.data.split("_")[1]
+    
+    if user_id in tasks and task_id in tasks[user_id]:
         task = tasks[user_id][task_id]
-        status_text = "✅ Completed" if task["completed"] else "⏳ In Progress"
-        
-        # Get deadline information
-        deadline_text = task["deadline"]
-        time_status = ""
-        
-        if not task["completed"]:
-            try:
-                if len(deadline_text.split()) == 1:
-                    # Only date (add 23:59)
-                    deadline = datetime.strptime(f"{deadline_text} 23:59", "%d.%m.%Y %H:%M")
-                else:
-                    deadline = datetime.strptime(deadline_text, "%d.%m.%Y %H:%M")
-                
-                # Calculate remaining time
-                time_diff = deadline - datetime.now()
-                
-                if time_diff.total_seconds() < 0:
-                    time_status = "⚠️ <b>Deadline passed</b>"
-                else:
-                    days = time_diff.days
-                    hours, remainder = divmod(time_diff.seconds, 3600)
-                    minutes, _ = divmod(remainder, 60)
-                    
-                    if days > 0:
-                        time_status = f"⏳ Remaining: {days} d. {hours} h. {minutes} min."
-                    elif hours > 0:
-                        time_status = f"⏳ Remaining: {hours} h. {minutes} min."
-                    else:
-                        time_status = f"⏳ Remaining: {minutes} min."
-            except ValueError:
-                time_status = ""
+        was_completed = task["completed"]
+        joined = toggle_assignee(task, callback.from_user.id)
+        # Leaving may complete the task if everyone else is done
+        if task.get("assignees"):
+            task["completed"] = task.get("done", 0) == (1 << len(task["assignees"])) - 1
+        if task["completed"] != was_completed:
+            task_changed(user_id, task_id)
         
+        await callback.answer(
+            "You joined the task. I'll send you reminders in a private chat (start me there first)."
+            if joined else "You left the task",
+            show_alert=joined
+        )
         await callback.message.edit_text(
-            f"🔹 <b>{task['name']}</b>\n\n"
-            f"Status: {status_text}\n"
-            f"Deadline: {task['deadline']}\n"
-            f"{time_status}\n"
-            f"Created: {task['created_at']}",
+            get_task_card(task),
             reply_markup=get_task_keyboard(user_id, task_id),
             parse_mode="HTML"
         )
+    else:
+        await callback.answer()
+
+@dp.callback_query(F.data.startswith("snooze_"))
+async def process_snooze(callback: CallbackQuery):
+    """Snoozes a reminder without changing the task's deadline"""
+    _, user_id, task_id, choice = callback.data.split("_")
+    user_id = int(user_id)
+    
+    # Keep this path cheap: one index update and one answer, the message is left as it is
+    if choice in SNOOZE_CHOICES and user_id in tasks and task_id in tasks[user_id]:
+        fire_at = snooze_reminder(user_id, task_id, callback.message.chat.id, choice)
+        await callback.answer(f"💤 I'll remind you again at {fire_at.strftime('%d.%m %H:%M')}")
+    else:
+        await callback.answer("This task is no longer available")
+
+@dp.callback_query(F.data.startswith("gdone_"))
+async def process_assignee_done(callback: CallbackQuery):
+    """Marks the assignee's part of a shared task from a reminder in a private chat"""
+    _, chat_id, task_id = callback.data.split("_")
+    chat_id = int(chat_id)
+    
+    if chat_id in tasks and task_id in tasks[chat_id] and callback.from_user.id in tasks[chat_id][task_id].get("assignees", []):
+        task = tasks[chat_id][task_id]
+        was_completed = task["completed"]
+        done = toggle_completed(task, callback.from_user.id)
+        if task["completed"] != was_completed:
+            task_changed(chat_id, task_id)
+        await callback.answer("Marked as done" if done else "Marked as not done")
+    else:
+        await callback.answer("This task is no longer available")
 
 @dp.callback_query(F.data.startswith("delete_"))
 async def process_delete_task(callback: CallbackQuery):
-    user_id = callback.from_user.id
+    user_id = callback.message.chat.id
     task_id = callback.data.split("_")[1]
     
     if user_id in tasks and task_id in tasks[user_id]:
         task_name = tasks[user_id][task_id]["name"]
         # Delete task
         del tasks[user_id][task_id]
+        task_changed(user_id, task_id)
         
         await callback.answer(f"Task \"{task_name}\" deleted")
         
@@ -849,7 +2890,7 @@ async def process_delete_task(callback: CallbackQuery):
 @dp.callback_query(F.data.startswith("edit_"))
 async def process_edit_task(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    user_id = callback.from_user.id
+    user_id = callback.message.chat.id
     task_id = callback.data.split("_")[1]
     
     if user_id in tasks and task_id in tasks[user_id]:
@@ -875,13 +2916,14 @@ async def process_edit_name(callback: CallbackQuery, state: FSMContext):
 
 @dp.message(TaskStates.waiting_for_edit_name)
 async def process_edit_name_input(message: Message, state: FSMContext):
-    user_id = message.from_user.id
+    user_id = message.chat.id
     user_data = await state.get_data()
     task_id = user_data["edit_task_id"]
     
     if user_id in tasks and task_id in tasks[user_id]:
         # Update task name
         tasks[user_id][task_id]["name"] = message.text.strip()
+        inline_cache.invalidate(user_id)
         
         await message.answer(
             f"✅ Task name updated to \"{message.text.strip()}\"",
@@ -925,11 +2967,7 @@ async def process_time_all_day(callback: CallbackQuery, state: FSMContext):
     # Form deadline string
     deadline_str = date_str  # Only date without time
     
-    user_id = callback.from_user.id
-    
-    # Initialize dictionary for user if it doesn't exist yet
-    if user_id not in tasks:
-        tasks[user_id] = {}
+    user_id = callback.message.chat.id
     
     # Check if we're editing an existing task
     is_editing = user_data.get("is_editing", False)
@@ -938,6 +2976,7 @@ async def process_time_all_day(callback: CallbackQuery, state: FSMContext):
         # Edit existing task
         edit_task_id = user_data.get("edit_task_id")
         tasks[user_id][edit_task_id]["deadline"] = deadline_str
+        task_changed(user_id, edit_task_id)
         
         await callback.message.edit_text(
             f"✅ Deadline for task \"{tasks[user_id][edit_task_id]['name']}\" "
@@ -945,21 +2984,12 @@ async def process_time_all_day(callback: CallbackQuery, state: FSMContext):
             reply_markup=get_task_keyboard(user_id, edit_task_id)
         )
     else:
-        # Generate unique ID for the task
-        task_id = str(len(tasks[user_id]) + 1)
-        
         # Add task
-        tasks[user_id][task_id] = {
-            "name": user_data.get("task_name"),
-            "deadline": deadline_str,
-            "completed": False,
-            "reminded": False,
-            "created_at": datetime.now().strftime("%d.%m.%Y %H:%M")
-        }
+        task_id = create_task(user_id, user_data.get("task_name"), deadline_str)
         
         await callback.message.edit_text(
             f"✅ Task \"{user_data.get('task_name')}\" with deadline {deadline_str} added!\n"
-            f"I will remind you 1 hour before the deadline.",
+            + get_reminders_notice(user_id, task_id),
             reply_markup=get_task_keyboard(user_id)
         )
     
@@ -992,24 +3022,384 @@ async def process_back_to_time(callback: CallbackQuery, state: FSMContext):
     # Call day selection handler
     await process_day_selection(callback, state)
 
+@dp.callback_query(F.data.startswith("archive_page_"))
+async def process_archive_page(callback: CallbackQuery):
+    """Shows a page of archived tasks"""
+    await callback.answer()
+    user_id = callback.message.chat.id
+    page = int(callback.data.split("_")[2])
+    
+    # Newest archived tasks first, only the current page is loaded and decompressed
+    total = tasks.archive_count(user_id)
+    page_rows = tasks.archive_page(user_id, page * ARCHIVE_PAGE_SIZE, ARCHIVE_PAGE_SIZE)
+    
+    kb = InlineKeyboardBuilder()
+    for task_id, data in page_rows:
+        task = json.loads(zlib.decompress(data))
+        status = "✅" if task["completed"] else "⌛"
+        kb.button(
+            text=f"{status} {task['name']} ({task['deadline']})",
+            callback_data=f"aview_{task_id}"
+        )
+    
+    # Pagination buttons
+    nav = []
+    if page > 0:
+        kb.button(text="«", callback_data=f"archive_page_{page - 1}")
+        nav.append(1)
+    if (page + 1) * ARCHIVE_PAGE_SIZE < total:
+        kb.button(text="»", callback_data=f"archive_page_{page + 1}")
+        nav.append(1)
+    kb.button(text="« Back to Tasks", callback_data="list_tasks")
+    kb.adjust(*([1] * len(page_rows)), *([len(nav)] if nav else []), 1)
+    
+    if page_rows:
+        text = f"🗄 <b>Archive</b> ({total} tasks):"
+    else:
+        text = "The archive is empty."
+    await callback.message.edit_text(text, reply_markup=kb.as_markup(), parse_mode="HTML")
+
+@dp.callback_query(F.data.startswith("aview_"))
+async def process_view_archived_task(callback: CallbackQuery):
+    """Shows an archived task"""
+    await callback.answer()
+    user_id = callback.message.chat.id
+    task_id = callback.data.split("_")[1]
+    
+    task = load_archived_task(user_id, task_id)
+    if task is not None:
+        status = "✅ Completed" if task["completed"] else "⌛ Overdue"
+        
+        kb = InlineKeyboardBuilder()
+        kb.button(text="♻️ Restore", callback_data=f"restore_{task_id}")
+        kb.button(text="🗑️ Delete", callback_data=f"adelete_{task_id}")
+        kb.button(text="« Back", callback_data="archive_page_0")
+        kb.adjust(2, 1)
+        
+        await callback.message.edit_text(
+            f"🗄 <b>{task['name']}</b>\n\n"
+            f"Status: {status}\n"
+            f"Deadline: {task['deadline']}\n"
+            f"Created: {task['created_at']}",
+            reply_markup=kb.as_markup(),
+            parse_mode="HTML"
+        )
+
+@dp.callback_query(F.data.startswith("restore_"))
+async def process_restore_task(callback: CallbackQuery):
+    """Moves an archived task back to the task list"""
+    user_id = callback.message.chat.id
+    task_id = callback.data.split("_")[1]
+    
+    if tasks.archive_get(user_id, task_id) is not None:
+        task = restore_task(user_id, task_id)
+        await callback.answer(f"Task \"{task['name']}\" restored")
+        await callback.message.edit_text(
+            f"♻️ Task \"{task['name']}\" restored. Edit the deadline if it has already passed.",
+            reply_markup=get_task_keyboard(user_id, task_id)
+        )
+    else:
+        await callback.answer()
+
+@dp.callback_query(F.data.startswith("adelete_"))
+async def process_delete_archived_task(callback: CallbackQuery):
+    """Deletes an archived task for good"""
+    user_id = callback.message.chat.id
+    task_id = callback.data.split("_")[1]
+    
+    if tasks.archive_get(user_id, task_id) is not None:
+        tasks.archive_delete(user_id, task_id)
+        await callback.answer("Task deleted")
+        callback.data = "archive_page_0"
+        await process_archive_page(callback)
+    else:
+        await callback.answer()
+
+# Inline mode: "@bot <query>" finds the user's tasks from any chat
+@dp.inline_query()
+async def process_inline_query(inline_query: InlineQuery):
+    user_id = inline_query.from_user.id
+    query = inline_query.query.strip().lower()
+    
+    results = []
+    if user_id in tasks:
+        user_tasks = tasks[user_id]
+        for task_id in inline_cache.search(user_id, query, user_tasks)[:INLINE_MAX_RESULTS]:
+            task = user_tasks[task_id]
+            status = "✅" if task["completed"] else "⏳"
+            results.append(InlineQueryResultArticle(
+                id=task_id,
+                title=f"{status} {task['name']}",
+                description=f"Deadline: {task['deadline']}",
+                input_message_content=InputTextMessageContent(
+                    message_text=get_task_card(task),
+                    parse_mode="HTML"
+                ),
+                reply_markup=get_inline_task_keyboard(user_id, task_id)
+            ))
+    
+    # Results depend on the user, so Telegram must not share them between users
+    await inline_query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=True,
+        button=None if results else InlineQueryResultsButton(text="No tasks found. Add one", start_parameter="add")
+    )
+
+@dp.callback_query(F.data.startswith("icomplete_"))
+async def process_inline_complete(callback: CallbackQuery):
+    """Toggles completion of a task from a message sent through inline mode"""
+    _, user_id, task_id = callback.data.split("_")
+    user_id = int(user_id)
+    
+    # Only the owner of the task may complete it
+    if callback.from_user.id != user_id or user_id not in tasks or task_id not in tasks[user_id]:
+        await callback.answer("Only the owner of the task can change it")
+        return
+    
+    task = tasks[user_id][task_id]
+    toggle_completed(task, user_id)
+    task_changed(user_id, task_id)
+    await callback.answer("Task marked as completed" if task["completed"] else "Task marked as not completed")
+    
+    await callback.bot.edit_message_text(
+        get_task_card(task),
+        inline_message_id=callback.inline_message_id,
+        reply_markup=get_inline_task_keyboard(user_id, task_id),
+        parse_mode="HTML"
+    )
+
+@dp.callback_query(F.data.startswith("remind_"))
+async def process_task_reminders(callback: CallbackQuery):
+    """Shows reminder offsets of a task"""
+    await callback.answer()
+    user_id = callback.message.chat.id
+    task_id = callback.data.split("_")[1]
+    
+    if user_id in tasks and task_id in tasks[user_id]:
+        task = tasks[user_id][task_id]
+        await callback.message.edit_text(
+            f"🔔 When should I remind you about \"{task['name']}\"?",
+            reply_markup=get_offsets_keyboard(
+                get_reminder_offsets(tasks[user_id], task), f"roff_{task_id}", f"view_{task_id}", f"rsave_{task_id}"
+            )
+        )
+
+@dp.callback_query(F.data.startswith("roff_"))
+async def process_toggle_task_offset(callback: CallbackQuery):
+    """Turns a reminder of a task on or off"""
+    await callback.answer()
+    user_id = callback.message.chat.id
+    _, task_id, offset = callback.data.split("_")
+    
+    if user_id in tasks and task_id in tasks[user_id]:
+        task = tasks[user_id][task_id]
+        offsets = toggle_offset(get_reminder_offsets(tasks[user_id], task), int(offset))
+        task["offsets"] = list(normalize_offsets(offsets))
+        schedule_reminder(user_id, task_id)
+        
+        await callback.message.edit_reply_markup(
+            reply_markup=get_offsets_keyboard(task["offsets"], f"roff_{task_id}", f"view_{task_id}", f"rsave_{task_id}")
+        )
+
+@dp.callback_query(F.data.startswith("rsave_"))
+async def process_save_default_offsets(callback: CallbackQuery):
+    """Makes the reminders of a task the default for the chat"""
+    user_id = callback.message.chat.id
+    task_id = callback.data.split("_")[1]
+    
+    if user_id in tasks and task_id in tasks[user_id]:
+        set_default_offsets(user_id, get_reminder_offsets(tasks[user_id], tasks[user_id][task_id]))
+        await callback.answer("Saved as your default reminders")
+    else:
+        await callback.answer()
+
+@dp.callback_query(F.data.startswith("rdef_"))
+async def process_toggle_default_offset(callback: CallbackQuery):
+    """Turns a default reminder on or off"""
+    await callback.answer()
+    user_id = callback.message.chat.id
+    offset = int(callback.data.split("_")[1])
+    
+    offsets = tasks[user_id].offsets if user_id in tasks else None
+    if offsets is None:
+        offsets = DEFAULT_REMINDER_OFFSETS
+    set_default_offsets(user_id, toggle_offset(offsets, offset))
+    
+    await callback.message.edit_reply_markup(
+        reply_markup=get_offsets_keyboard(tasks[user_id].offsets, "rdef", "list_tasks")
+    )
+
+# Quick-add: any other text in a private chat is read as "name + deadline"
+@dp.message(StateFilter(None), F.chat.type == "private", F.text, ~F.text.startswith("/"))
+async def process_quick_add(message: Message):
+    if not await quick_add(message, message.text):
+        await message.answer(
+            "I couldn't find a deadline in that message.\n"
+            "Send e.g. \"Pay rent 01.11 18:00\" or \"Call Bob tomorrow 9am\", "
+            "or use ➕ Add Task to pick a date from the calendar.",
+            reply_markup=get_main_keyboard()
+        )
+
 # Add a handler for ignoring clicks on weekdays and empty cells
 @dp.callback_query(F.data == "ignore")
 async def process_ignore_button(callback: CallbackQuery):
     """Ignores clicks on weekday headers and empty cells"""
     await callback.answer()
 
+async def archive_tasks():
+    """Periodically moves completed and long-overdue tasks of resident users to cold storage"""
+    while True:
+        try:
+            archived = archive_expired_tasks(clock.now())
+        except sqlite3.Error:
+            # Tasks that were not archived stay in their task sets until the next run
+            logging.exception("Failed to archive tasks")
+        else:
+            if archived:
+                logging.info("Archived %d tasks", archived)
+        
+        await clock.sleep(ARCHIVE_INTERVAL)
+
+def archive_expired_tasks(now):
+    """Moves completed and long-overdue tasks of resident users to cold storage, returns their number"""
+    archived = 0
+    # Tasks of idle users are archived once they are paged in again
+    for (bot_id, user_id), user_tasks in tasks.resident():
+        current_bot_id.set(bot_id)
+        for task_id, task in list(user_tasks.items()):
+            try:
+                if task["completed"]:
+                    since = datetime.strptime(task.get("completed_at", task["created_at"]), "%d.%m.%Y %H:%M")
+                    keep = ARCHIVE_COMPLETED_AFTER
+                else:
+                    since = parse_deadline(task["deadline"])
+                    keep = ARCHIVE_OVERDUE_AFTER
+                # A restored task stays for the whole period again
+                if "restored_at" in task:
+                    since = max(since, datetime.strptime(task["restored_at"], "%d.%m.%Y %H:%M"))
+                expired = now - since > keep
+            except ValueError:
+                continue
+            
+            if expired:
+                archive_task(user_id, task_id)
+                archived += 1
+    return archived
+
+async def flush_tasks():
+    """Periodically writes changed task sets to the database"""
+    full_flush_at = time.monotonic() + TASK_FULL_FLUSH_INTERVAL
+    while True:
+        await clock.sleep(TASK_FLUSH_INTERVAL)
+        try:
+            if time.monotonic() < full_flush_at:
+                tasks.flush(touched_only=True)
+                continue
+            tasks.flush()
+            full_flush_at = time.monotonic() + TASK_FULL_FLUSH_INTERVAL
+            sent_reminders.prune(time.time() - SENT_REMINDER_RETENTION.total_seconds())
+        except sqlite3.Error:
+            # Task sets that were not written stay changed and are written by the next flush
+            logging.exception("Failed to write tasks")
+            continue
+        logging.info("Task cache: %s, dropped log records: %d", tasks.metrics(), log_handler.dropped)
+
+async def flush_sent_reminders():
+    """Periodically writes which claimed reminders were sent or dropped"""
+    while True:
+        await asyncio.sleep(SENT_REMINDER_FLUSH_INTERVAL)
+        try:
+            sent_reminders.flush()
+        except sqlite3.Error:
+            logging.exception("Failed to write sent reminders")
+
 # Function for starting background tasks
 async def start_background_tasks():
-    # Start deadline checking in the background
-    asyncio.create_task(check_deadlines())
+    """Starts the work of the leader and returns its asyncio tasks, or None if the lease was lost meanwhile"""
+    # Tasks come from the database, the previous leader may have changed them
+    tasks.reset()
+    reminder_index.clear()
+    # Count statistics of tasks stored before they were kept, then build the index of upcoming reminders
+    # (the previous leader may have stopped in the middle of sending). Both read every stored task set,
+    # so they go in chunks that let the event loop run and the lease be renewed.
+    renewed_at = time.monotonic()
+    steps = itertools.chain(tasks.seed_stats_steps(clock.now()), load_reminder_index_steps(REMINDER_CATCH_UP))
+    for _ in steps:
+        await asyncio.sleep(0)
+        if time.monotonic() - renewed_at >= LEASE_RENEW_INTERVAL:
+            if not lease.renew():
+                return None
+            renewed_at = time.monotonic()
+    return {
+        # Start deadline checking
+        "scheduler": asyncio.create_task(check_deadlines()),
+        # Start writing task changes to the database
+        "flush": asyncio.create_task(flush_tasks()),
+        # Start moving finished tasks to the archive
+        "archive": asyncio.create_task(archive_tasks()),
+        # Start the bots
+        "polling": asyncio.create_task(
+            dp.start_polling(*bots.values(), handle_signals=False, close_bot_session=False)
+        ),
+    }
+
+async def stop_background_tasks(background):
+    """Stops the work of a replica that lost the lease and forgets its tasks"""
+    if not background["polling"].done():
+        try:
+            await dp.stop_polling()
+        except RuntimeError:
+            # Polling has not started yet, cancelling its task is enough
+            pass
+    for task in background.values():
+        task.cancel()
+    await asyncio.gather(*background.values(), return_exceptions=True)
+    # Writes are version-checked, so changes another replica made in the meantime are kept
+    try:
+        tasks.flush()
+    except sqlite3.Error:
+        logging.exception("Failed to write tasks of the lost lease")
+    tasks.reset()
+    reminder_index.clear()
 
 # Bot startup
 async def main():
-    logging.info("Bot started")
-    # Start background tasks
-    await start_background_tasks()
-    # Start the bot
-    await dp.start_polling(bot)
+    # All bots share one HTTP session and its connection pool
+    session = AiohttpSession()
+    session.middleware(LaneMiddleware())
+    for token in BOT_TOKENS:
+        bot = Bot(token=token, session=session)
+        bots[bot.id] = bot
+    
+    logging.info("Bots started: %s", list(bots))
+    # Reminder senders run on every replica, so one that lost the lease releases its queued reminders
+    for _ in range(REMINDER_WORKERS):
+        asyncio.create_task(reminder_worker())
+    # Start recording sent reminders
+    asyncio.create_task(flush_sent_reminders())
+    # Handle updates and reminders whenever this replica is the leader
+    try:
+        await lead()
+    finally:
+        tasks.flush()
+        sent_reminders.flush()
+        lease.release()
+        await session.close()
+
+def parse_duration(text):
+    """Converts "90m", "12h", "1d" or "1w" to timedelta"""
+    units = {"m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+    return timedelta(**{units[text[-1]]: float(text[:-1])})
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Task planner bot")
+    parser.add_argument("--simulate", metavar="DURATION", type=parse_duration,
+                        help="simulate the reminder scheduler for a period like 1d or 1w instead of running the bot")
+    parser.add_argument("--tasks", type=int, default=1000000, help="number of tasks in the simulation")
+    args = parser.parse_args()
+    
+    if args.simulate:
+        simulate(args.simulate, args.tasks)
+    else:
+        asyncio.run(main()) 
\ No newline at end of file
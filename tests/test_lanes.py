@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+from aiogram.methods import AnswerCallbackQuery, SendMessage
+
+import main
+from main import LaneMiddleware, LeaseLost, current_lane, get_lanes
+
+
+class FakeBot:
+    id = 301
+
+
+async def make_request(bot, method):
+    return True
+
+
+def test_only_messages_use_the_rate_budget():
+    lanes = get_lanes(FakeBot.id)
+    lane = lanes.lanes["interactive"]
+    middleware = LaneMiddleware()
+    tokens = lane.tokens
+    
+    asyncio.run(middleware(make_request, FakeBot(), AnswerCallbackQuery(callback_query_id="1")))
+    assert lane.tokens >= tokens
+    asyncio.run(middleware(make_request, FakeBot(), SendMessage(chat_id=1, text="Hi")))
+    assert lane.tokens < tokens
+
+
+def test_reminder_needs_the_lease_when_it_goes_out():
+    middleware = LaneMiddleware()
+    token = current_lane.set("background")
+    try:
+        main.lease.release()
+        with pytest.raises(LeaseLost):
+            asyncio.run(middleware(make_request, FakeBot(), SendMessage(chat_id=1, text="Hi")))
+        
+        assert main.lease.renew()
+        assert asyncio.run(middleware(make_request, FakeBot(), SendMessage(chat_id=1, text="Hi")))
+    finally:
+        main.lease.release()
+        current_lane.reset(token)
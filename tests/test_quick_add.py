@@ -0,0 +1,67 @@
+from datetime import datetime
+
+from main import parse_quick_add
+
+# Monday
+NOW = datetime(2026, 10, 19, 12, 0)
+
+
+def test_date_and_time():
+    assert parse_quick_add("Pay rent 01.11 18:00", NOW) == ("Pay rent", "01.11.2026 18:00")
+
+
+def test_date_with_year():
+    assert parse_quick_add("Renew passport 3.2.2027", NOW) == ("Renew passport", "03.02.2027")
+
+
+def test_past_date_without_year_is_next_year():
+    assert parse_quick_add("Dentist on 05.03 9am", NOW) == ("Dentist", "05.03.2027 09:00")
+
+
+def test_day_word_and_12_hour_time():
+    assert parse_quick_add("Call Bob tomorrow 9am", NOW) == ("Call Bob", "20.10.2026 09:00")
+
+
+def test_decimal_is_not_a_date():
+    assert parse_quick_add("Read chapter 3.2 tomorrow", NOW) == ("Read chapter 3.2", "20.10.2026")
+
+
+def test_version_number_is_not_a_date():
+    assert parse_quick_add("Upgrade to 1.12.3 on friday", NOW) == ("Upgrade to 1.12.3", "23.10.2026")
+
+
+def test_on_marks_a_short_date():
+    assert parse_quick_add("Exam on 3.2", NOW) == ("Exam", "03.02.2027")
+
+
+def test_relative_hours():
+    assert parse_quick_add("Stretch in 2h", NOW) == ("Stretch", "19.10.2026 14:00")
+
+
+def test_relative_days_with_time():
+    assert parse_quick_add("meeting in 2 days at 18:00", NOW) == ("meeting", "21.10.2026 18:00")
+
+
+def test_relative_days_keep_current_time():
+    assert parse_quick_add("Water plants in 3 days", NOW) == ("Water plants", "22.10.2026 12:00")
+
+
+def test_day_word_overrides_relative_date():
+    assert parse_quick_add("Standup tomorrow in 1 hour", NOW) == ("Standup", "20.10.2026 13:00")
+
+
+def test_time_only_rolls_over_to_tomorrow():
+    assert parse_quick_add("Take pills at 8:00", NOW) == ("Take pills", "20.10.2026 08:00")
+
+
+def test_no_deadline():
+    assert parse_quick_add("Buy milk", NOW) is None
+
+
+def test_past_deadline():
+    assert parse_quick_add("Lunch 19.10.2026 11:00", NOW) is None
+
+
+def test_huge_relative_amount():
+    assert parse_quick_add("Renew in 99999999 days", NOW) is None
+    assert parse_quick_add("x in 9999999999 days", NOW) is None
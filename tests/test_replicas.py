@@ -0,0 +1,186 @@
+import sqlite3
+import time
+from datetime import timedelta
+
+import pytest
+
+import main
+from main import SchedulerLease, SentReminderLog, TaskStore
+
+
+def test_lease_is_held_by_one_replica(tmp_path):
+    path = tmp_path / "lease.db"
+    first = SchedulerLease(path, "first", 60)
+    second = SchedulerLease(path, "second", 60)
+    
+    assert first.renew()
+    assert not second.renew()
+    assert first.renew()
+    assert first.held() and not second.held()
+
+
+def test_lease_fails_over_after_ttl(tmp_path):
+    path = tmp_path / "lease.db"
+    first = SchedulerLease(path, "first", 0.2)
+    second = SchedulerLease(path, "second", 0.2)
+    assert first.renew()
+    
+    time.sleep(0.3)
+    assert not first.held()
+    assert second.renew()
+    assert not first.renew()
+
+
+def test_released_lease_is_taken_at_once(tmp_path):
+    path = tmp_path / "lease.db"
+    first = SchedulerLease(path, "first", 60)
+    second = SchedulerLease(path, "second", 60)
+    assert first.renew()
+    
+    first.release()
+    assert second.renew()
+
+
+def test_reminder_is_claimed_once(tmp_path):
+    log = SentReminderLog(tmp_path / "sent.db", "first")
+    
+    assert log.claim(["a", "b"]) == {"a", "b"}
+    assert log.claim(["a", "b", "c"]) == {"c"}
+    log.mark_sent("a")
+    log.flush()
+    assert log.claim(["a"]) == set()
+
+
+def test_released_claim_can_be_claimed_again(tmp_path):
+    log = SentReminderLog(tmp_path / "sent.db", "first")
+    assert log.claim(["a"]) == {"a"}
+    
+    log.release("a")
+    log.flush()
+    assert log.claim(["a"]) == {"a"}
+
+
+def test_new_leader_takes_over_unconfirmed_claims(tmp_path):
+    path = tmp_path / "sent.db"
+    first = SentReminderLog(path, "first")
+    second = SentReminderLog(path, "second")
+    assert first.claim(["sent", "queued"]) == {"sent", "queued"}
+    first.mark_sent("sent")
+    first.flush()
+    
+    # The first replica stopped before sending "queued"
+    assert second.claim(["sent", "queued"]) == {"queued"}
+    # Its late release does not drop the new leader's claim
+    first.release("queued")
+    first.flush()
+    assert second.claim(["queued"]) == set()
+
+
+def test_fired_stage_is_queued_once():
+    main.current_bot_id.set(0)
+    deadline = (main.clock.now() + timedelta(hours=1)).strftime("%d.%m.%Y %H:%M")
+    task_id = main.create_task(201, "Pick up parcel", deadline)
+    queued = main.reminder_queue.qsize()
+    
+    # The stage fires again, e.g. after the task was rescheduled within the grace period
+    for _ in range(2):
+        main.queue_reminder(0, 201, task_id, timedelta(hours=1))
+        main.queue_claimed_reminders()
+    assert main.reminder_queue.qsize() == queued + 1
+    
+    # A reminder dropped by the worker is fired again later
+    *_, key = main.reminder_queue.get_nowait()
+    main.sent_reminders.release(key)
+    main.sent_reminders.flush()
+    main.queue_reminder(0, 201, task_id, timedelta(hours=1))
+    main.queue_claimed_reminders()
+    assert main.reminder_queue.qsize() == queued + 1
+
+
+def test_stale_task_set_is_not_written_over(tmp_path):
+    main.current_bot_id.set(0)
+    path = tmp_path / "tasks.db"
+    first = TaskStore(path, 10, 100)
+    second = TaskStore(path, 10, 100)
+    first[1] = {"1": {"name": "Old", "deadline": "01.01.2030 10:00", "completed": False}}
+    first.flush()
+    
+    assert 1 in second
+    first[1]["1"]["name"] = "Newer"
+    first.flush()
+    # The second replica still has the task set it loaded before
+    second[1]["1"]["name"] = "Stale"
+    second.flush()
+    assert second.metrics()["conflicts"] == 1
+    assert second[1]["1"]["name"] == "Newer"
+
+
+def test_statistics_of_replicas_add_up(tmp_path):
+    path = tmp_path / "tasks.db"
+    first = TaskStore(path, 10, 100)
+    first.seed_stats(main.clock.now())
+    second = TaskStore(path, 10, 100)
+    
+    first.count({"created": 1}, 0)
+    second.count({"created": 2}, 0)
+    first.flush()
+    second.flush()
+    assert TaskStore(path, 10, 100).fleet[0]["created"] == 3
+
+
+def test_snooze_survives_a_new_leader():
+    main.current_bot_id.set(0)
+    deadline = (main.clock.now() + timedelta(days=1)).strftime("%d.%m.%Y %H:%M")
+    task_id = main.create_task(202, "Water plants", deadline)
+    fire_at = main.snooze_reminder(202, task_id, 202, "1h")
+    
+    main.tasks.flush()
+    main.tasks.reset()
+    main.reminder_index.clear()
+    main.load_reminder_index()
+    assert main.reminder_index.pending[(0, 202, task_id, 202)][0] == fire_at.timestamp()
+
+
+def test_used_task_sets_are_written_without_a_full_flush(tmp_path):
+    main.current_bot_id.set(0)
+    path = tmp_path / "tasks.db"
+    first = TaskStore(path, 10, 100)
+    first[1] = {"1": {"name": "Call", "deadline": "01.01.2030 10:00", "completed": False}}
+    first.flush(touched_only=True)
+    
+    first[1]["1"]["name"] = "Call back"
+    first.flush(touched_only=True)
+    assert TaskStore(path, 10, 100)[1]["1"]["name"] == "Call back"
+
+
+def failing_page_in(keys):
+    raise sqlite3.OperationalError("database is locked")
+
+
+def test_fires_are_kept_when_the_database_fails():
+    main.current_bot_id.set(0)
+    deadline = (main.clock.now() + timedelta(days=1)).strftime("%d.%m.%Y %H:%M")
+    task_id = main.create_task(203, "Book tickets", deadline)
+    key = (0, 203, task_id, 203)
+    main.reminder_index.schedule(key, main.clock.now().timestamp() - 1, None, None, None)
+    
+    with pytest.raises(sqlite3.OperationalError):
+        main.fire_due_reminders(main.queue_reminder, main.mark_overdue, failing_page_in)
+    assert key in main.reminder_index.pending
+
+
+def test_claims_are_kept_while_the_database_is_locked():
+    main.current_bot_id.set(0)
+    deadline = (main.clock.now() + timedelta(hours=1)).strftime("%d.%m.%Y %H:%M")
+    task_id = main.create_task(204, "Renew permit", deadline)
+    queued = main.reminder_queue.qsize()
+    main.queue_reminder(0, 204, task_id, timedelta(hours=1))
+    
+    lock = sqlite3.connect(main.DB_PATH)
+    lock.execute("BEGIN EXCLUSIVE")
+    with pytest.raises(sqlite3.OperationalError):
+        main.queue_claimed_reminders()
+    lock.rollback()
+    
+    main.queue_claimed_reminders()
+    assert main.reminder_queue.qsize() == queued + 1
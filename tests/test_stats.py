@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+import main
+from main import archive_task, clock, create_task, restore_task, task_changed, tasks, toggle_completed
+
+
+def deadline_in(delta):
+    return (clock.now() + delta).strftime("%d.%m.%Y %H:%M")
+
+
+def toggle(user_id, task_id):
+    toggle_completed(tasks[user_id][task_id], user_id)
+    task_changed(user_id, task_id)
+
+
+def test_completion_counts():
+    task_id = create_task(101, "Write report", deadline_in(timedelta(days=1)))
+    create_task(101, "Send invoice", deadline_in(timedelta(days=1)))
+    toggle(101, task_id)
+    
+    stats = tasks[101].stats
+    assert (stats["created"], stats["completed"], stats["on_time"], stats["open"]) == (2, 1, 1, 1)
+    assert stats["streak"] == 1
+
+
+def test_uncomplete_takes_completion_back():
+    task_id = create_task(102, "Call mom", deadline_in(timedelta(hours=2)))
+    toggle(102, task_id)
+    toggle(102, task_id)
+    
+    stats = tasks[102].stats
+    assert (stats["completed"], stats["on_time"], stats["open"]) == (0, 0, 1)
+
+
+def test_archive_and_restore_do_not_count_twice():
+    task_id = create_task(103, "Pay rent", deadline_in(timedelta(days=1)))
+    toggle(103, task_id)
+    archive_task(103, task_id)
+    restore_task(103, task_id)
+    assert tasks[103][task_id]["completed"]
+    assert (tasks[103].stats["created"], tasks[103].stats["completed"]) == (1, 1)
+    
+    toggle(103, task_id)
+    toggle(103, task_id)
+    assert (tasks[103].stats["created"], tasks[103].stats["completed"], tasks[103].stats["open"]) == (1, 1, 0)
+
+
+def test_overdue_task_restored_stays_overdue():
+    task_id = create_task(104, "Renew visa", deadline_in(timedelta(days=-10)))
+    main.mark_overdue(main.current_bot_id.get(), 104, task_id)
+    assert tasks[104].stats["overdue"] == 1
+    
+    archive_task(104, task_id)
+    assert (tasks[104].stats["open"], tasks[104].stats["overdue"]) == (0, 0)
+    restore_task(104, task_id)
+    assert (tasks[104].stats["open"], tasks[104].stats["overdue"]) == (1, 1)
+
+
+def test_fleet_totals_follow_chats():
+    before = dict(tasks.fleet.get(main.current_bot_id.get(), {}))
+    task_id = create_task(105, "Book flights", deadline_in(timedelta(days=3)))
+    toggle(105, task_id)
+    after = tasks.fleet[main.current_bot_id.get()]
+    
+    assert after["users"] - before.get("users", 0) == 1
+    assert after["created"] - before.get("created", 0) == 1
+    assert after["completed"] - before.get("completed", 0) == 1
+
+
+def test_interrupted_seeding_goes_on(tmp_path):
+    main.current_bot_id.set(0)
+    path = tmp_path / "tasks.db"
+    store = main.TaskStore(path, 10, 100)
+    for user_id in (1, 2, 3):
+        store[user_id] = {"1": {"name": "Plan", "deadline": deadline_in(timedelta(days=1)), "completed": False}}
+    store.flush()
+    
+    # The first chunk is counted before the replica stops
+    steps = store.seed_stats_steps(clock.now(), chunk_size=2)
+    next(steps)
+    store = main.TaskStore(path, 10, 100)
+    store.seed_stats(clock.now())
+    assert store.fleet[0]["created"] == 3
+    assert main.TaskStore(path, 10, 100).fleet[0]["created"] == 3